@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+batch_scaling.py - Measure how the latency of each stage scales with the batch size.
+
+Runs the whole submission (run_submission.py) with each of the given custom
+batch sizes, each in its own batch-<n> instance directories, and fits the
+median latency of every stage, and of all of them, to
+    latency = fixed cost + per-sample cost * batch size
+The report is written to measurements/batch_scaling/, as scaling.csv (one
+row per stage, with its fit and its median latency at each batch size) and
+scaling.json (the series of every stage, ready to plot).
+"""
+
+import argparse
+import csv
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from params import InstanceParams, SINGLE, LARGE, MAX_BATCH_SIZE
+
+# Name of the series of the total latency in the report
+TOTAL = "Total latency"
+
+def parse_batch_sizes(text: str) -> list:
+    """ Parse a comma-separated list of batch sizes, e.g. 1,2,4,8 """
+    try:
+        batch_sizes = sorted({int(b) for b in text.split(",") if b.strip()})
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid batch sizes: {text}")
+    if len(batch_sizes) < 2 or batch_sizes[0] < 1:
+        raise argparse.ArgumentTypeError("at least two distinct positive batch sizes are needed")
+    if batch_sizes[-1] > MAX_BATCH_SIZE:
+        raise argparse.ArgumentTypeError(f"the batch sizes cannot exceed {MAX_BATCH_SIZE}, "
+                                         "the size of the MNIST test set")
+    return batch_sizes
+
+def linear_fit(batch_sizes, latencies) -> dict:
+    """ Least-squares fit of latencies = fixed_s + per_sample_s * batch_sizes """
+    x, y = np.asarray(batch_sizes, dtype=float), np.asarray(latencies, dtype=float)
+    per_sample, fixed = np.polyfit(x, y, 1)
+    residuals = y - (fixed + per_sample * x)
+    total_variance = np.sum((y - y.mean()) ** 2)
+    r_squared = 1 - np.sum(residuals ** 2) / total_variance if total_variance > 0 else 1.0
+    return {
+        "fixed_s": round(float(fixed), 6),
+        "per_sample_s": round(float(per_sample), 9),
+        "r_squared": round(float(r_squared), 6),
+    }
+
+def scaling_report(summaries: dict) -> dict:
+    """
+    Collect the median latency of each stage, and its confidence interval,
+    from the summary.json of each batch size, and fit each stage.
+    Stages measured at fewer than two batch sizes are not fitted.
+    """
+    stages = {}
+    for batch_size, summary in summaries.items():
+        series = {TOTAL: summary["total_latency_s"], **summary["per_stage_s"]}
+        for stage, stats in series.items():
+            points = stages.setdefault(stage, {"batch_sizes": [], "median_s": [],
+                                               "ci_low_s": [], "ci_high_s": []})
+            points["batch_sizes"].append(batch_size)
+            points["median_s"].append(stats["median"])
+            points["ci_low_s"].append(stats["ci_low"])
+            points["ci_high_s"].append(stats["ci_high"])
+    for points in stages.values():
+        if len(points["batch_sizes"]) >= 2:
+            points["fit"] = linear_fit(points["batch_sizes"], points["median_s"])
+    return {
+        "batch_sizes": list(summaries),
+        "statistic": "median",
+        "stages": stages,
+    }
+
+def write_csv(path: Path, report: dict):
+    """ One row per stage: its fit, then its median latency at each batch size """
+    batch_sizes = report["batch_sizes"]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stage", "fixed_s", "per_sample_s", "r_squared",
+                         *[f"median_s_batch_{b}" for b in batch_sizes]])
+        for stage, points in report["stages"].items():
+            fit = points.get("fit", {})
+            medians = dict(zip(points["batch_sizes"], points["median_s"]))
+            writer.writerow([stage, fit.get("fixed_s", ""), fit.get("per_sample_s", ""),
+                             fit.get("r_squared", ""), *[medians.get(b, "") for b in batch_sizes]])
+
+def main():
+    """
+    Usage:  python3 batch_scaling.py  --batch 1,2,4,...  [--size SIZE]  [run_submission.py options]
+    """
+    parser = argparse.ArgumentParser(
+        description='Measure the scaling of the ML Inference FHE benchmark with the batch size. '
+                    'The other options are passed on to run_submission.py.')
+    parser.add_argument('--batch', type=parse_batch_sizes, required=True,
+                        help='Comma-separated batch sizes to run, e.g. 1,2,4,8')
+    parser.add_argument('--size', type=int, choices=range(SINGLE, LARGE+1), default=1,
+                        help='Instance size whose parameters are used for every batch size (default: 1)')
+    args, submission_options = parser.parse_known_args()
+
+    harness_dir = Path(__file__).resolve().parent
+    summaries = {}
+    for batch_size in args.batch:
+        print(f"\n[scaling] Batch size {batch_size}")
+        subprocess.run([sys.executable, harness_dir/"run_submission.py", str(args.size),
+                        "--batch_size", str(batch_size), *submission_options], check=True)
+        params = InstanceParams(args.size, batch_size=batch_size)
+        with open(params.measuredir() / "summary.json") as f:
+            summaries[batch_size] = json.load(f)
+
+    report = scaling_report(summaries)
+    report_dir = InstanceParams(args.size).rootdir / "measurements" / "batch_scaling"
+    report_dir.mkdir(parents=True, exist_ok=True)
+    with open(report_dir / "scaling.json", "w") as f:
+        json.dump(report, f, indent=2)
+    write_csv(report_dir / "scaling.csv", report)
+
+    print(f"\n[scaling] {'Stage':<70} {'fixed':>10} {'per sample':>12} {'R^2':>8}")
+    for stage, points in report["stages"].items():
+        if "fit" in points:
+            fit = points["fit"]
+            print(f"[scaling] {stage:<70} {fit['fixed_s']:>9.4f}s {fit['per_sample_s']:>11.6f}s",
+                  f"{fit['r_squared']:>8.4f}")
+    print(f"[scaling] Report written to {report_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+cache.py - Persistent, content-addressed caches for the harness.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Tuple
+
+def file_digest(*paths: Path) -> str:
+    """ Return the SHA-256 hex digest of the concatenated contents of the files """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def bytes_digest(data: bytes) -> str:
+    """ Return the SHA-256 hex digest of data """
+    return hashlib.sha256(data).hexdigest()
+
+def tree_files(*paths: Path, exclude: tuple = ()) -> list:
+    """
+    Return the files under paths (files or directories), in a stable order,
+    skipping the directories named in exclude
+    """
+    files = []
+    for path in map(Path, paths):
+        if path.is_file():
+            files.append(path)
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names[:] = sorted(d for d in dir_names if d not in exclude)
+            files.extend(Path(dir_path) / f for f in sorted(file_names))
+    return files
+
+def tree_digest(*paths: Path, exclude: tuple = ()) -> str:
+    """
+    Return the SHA-256 hex digest of the names and contents of the files
+    under paths. Missing paths are digested as such.
+    """
+    digest = hashlib.sha256()
+    for path in map(Path, paths):
+        digest.update(f"{path.name}{'' if path.exists() else ' (missing)'}\0".encode())
+        for file in tree_files(path, exclude=exclude):
+            digest.update(f"{file.relative_to(path) if file != path else ''}\0".encode())
+            digest.update(file_digest(file).encode())
+    return digest.hexdigest()
+
+def tree_state(*paths: Path) -> dict:
+    """ Return the size and modification time of each file under paths """
+    state = {}
+    for file in tree_files(*paths):
+        stat = file.stat()
+        state[str(file)] = [stat.st_size, stat.st_mtime_ns]
+    return state
+
+def link_files(src_dir: Path, dest_dir: Path):
+    """
+    Hard-link the files of src_dir into dest_dir, or copy them if they are
+    on different file systems.
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    for entry in os.scandir(src_dir):
+        if entry.is_file():
+            dest = dest_dir / entry.name
+            dest.unlink(missing_ok=True)
+            try:
+                os.link(entry.path, dest)
+            except OSError:
+                shutil.copyfile(entry.path, dest)
+
+class DirectoryCache:
+    """
+    Sets of directories stored under a key, which are linked into place
+    rather than copied. The entries are never evicted.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+
+    def entry(self, key: str) -> Path:
+        """Return the directory of the cache entry for key."""
+        return self.cache_dir / key
+
+    def get(self, key: str, dest_dirs: dict) -> bool:
+        """
+        Link the files of each directory name of the entry for key into
+        dest_dirs[name]. Return False on a cache miss.
+        """
+        path = self.entry(key)
+        if not path.is_dir():
+            return False
+        for name, dest_dir in dest_dirs.items():
+            link_files(path / name, dest_dir)
+        return True
+
+    def put(self, key: str, src_dirs: dict):
+        """Store the files of src_dirs[name] under key, each in the directory name."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=f".{key}.", suffix=".tmp"))
+        for name, src_dir in src_dirs.items():
+            link_files(src_dir, tmp_path / name)
+        try:
+            os.rename(tmp_path, self.entry(key))
+        except OSError:
+            # Stored concurrently by another invocation
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+class LRUFileCache:
+    """
+    A directory of files named by their key. Once the total size exceeds
+    max_bytes, the least recently used entries are evicted; recency is
+    tracked with the modification time of the entries.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def entry(self, key: str) -> Path:
+        """Return the path of the cache entry for key."""
+        return self.cache_dir / key
+
+    def get(self, key: str, dest: Path) -> bool:
+        """Copy the entry for key to dest. Return False on a cache miss."""
+        path = self.entry(key)
+        try:
+            shutil.copyfile(path, dest)
+            os.utime(path)
+        except FileNotFoundError:
+            # Missing, or evicted meanwhile by another thread or process
+            return False
+        return True
+
+    def put(self, key: str, src: Path):
+        """Store a copy of src under key and evict old entries if needed."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # A temporary file of its own, as other threads and processes (see
+        # run_matrix.py) may store the same key concurrently
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{key}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, self.entry(key))
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep: str = None):
+        """
+        Remove the least recently used entries until the cache fits in
+        max_bytes. The entry for keep, which was just stored, is never
+        removed, even if it alone exceeds max_bytes. Entries removed
+        meanwhile by another thread or process are skipped.
+        """
+        entries = []
+        for e in os.scandir(self.cache_dir):
+            if e.is_file() and not e.name.startswith("."):
+                try:
+                    entries.append((e, e.stat()))
+                except FileNotFoundError:
+                    pass
+        entries.sort(key=lambda entry: (entry[0].name == keep, entry[1].st_mtime), reverse=True)
+        total = 0
+        for e, stat in entries:
+            total += stat.st_size
+            if total > self.max_bytes and e.name != keep:
+                try:
+                    os.unlink(e.path)
+                except FileNotFoundError:
+                    pass
+
+class StageManifest:
+    """
+    The manifest of a setup stage: the fingerprint of its inputs (source
+    digests, parameters) and the state of the outputs it produced. The stage
+    can be skipped while its inputs have the same fingerprint and its outputs
+    are in place, unmodified. The inputs are given as a function, so that
+    inputs produced by the stage itself (e.g. downloaded files) are
+    fingerprinted once they exist.
+    """
+
+    def __init__(self, path: Path, inputs: Callable[[], dict], outputs: list):
+        self.path = Path(path)
+        self.inputs = inputs
+        self.outputs = [Path(output) for output in outputs]
+
+    def fingerprint(self) -> str:
+        """Return the digest of the current inputs."""
+        return bytes_digest(json.dumps(self.inputs(), sort_keys=True).encode())
+
+    def lookup(self) -> Tuple[bool, str]:
+        """Return whether the outputs are up to date, and the fingerprint of the inputs."""
+        fingerprint = self.fingerprint()
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False, fingerprint
+        fresh = (manifest.get("fingerprint") == fingerprint
+                 and all(output.exists() for output in self.outputs)
+                 and manifest.get("outputs") == tree_state(*self.outputs))
+        return fresh, fingerprint
+
+    def record(self) -> str:
+        """Record the fingerprint of the inputs and the state of the outputs. Return the fingerprint."""
+        inputs = self.inputs()
+        fingerprint = bytes_digest(json.dumps(inputs, sort_keys=True).encode())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "inputs": inputs,
+                       "outputs": tree_state(*self.outputs)}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        return fingerprint
@@ -8,9 +8,22 @@ For each test case:
 
 import sys
 from pathlib import Path
-from utils import parse_submission_arguments
 from mnist import mnist
 
+MODEL_PATH = Path("harness") / "mnist" / "mnist_ffnn_model.pth"
+
+def ensure_model():
+    """
+    Train the harness model if it does not exist yet.
+    """
+    mnist.ensure_model(model_path=MODEL_PATH)
+
+def run_cleartext(input_path: Path, output_path: Path):
+    """
+    Write the harness model predictions for the pixels in input_path to output_path.
+    """
+    mnist.run_predict(model_path=MODEL_PATH, pixels_file=input_path, predictions_file=output_path)
+
 def main():
     """
     Usage:  python3 cleartext_impl.py  <input_pixels_path>  <output_labels_path>
@@ -19,11 +32,7 @@ def main():
     if len(sys.argv) != 3:
         sys.exit("Usage: cleartext_impl.py <input_pixels_path> <output_labels_path>")
 
-    INPUT_PATH = Path(sys.argv[1])
-    OUTPUT_PATH = Path(sys.argv[2])
-    model_path = "harness/mnist/mnist_ffnn_model.pth"
-
-    mnist.run_predict(model_path=model_path, pixels_file=INPUT_PATH, predictions_file=OUTPUT_PATH)
+    run_cleartext(Path(sys.argv[1]), Path(sys.argv[2]))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
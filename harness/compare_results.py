@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+compare_results.py - Compare a candidate set of measurements against a baseline.
+
+Loads the results-N.json files of two measurement directories (e.g. two
+copies of measurements/<size>), aligns them per stage and per bandwidth
+artifact, and reports the relative change of the median of each, with its
+bootstrap confidence interval. A stage regresses when its median latency
+increases by more than the threshold and a two-sided Mann-Whitney U test
+finds the difference significant; when either set has a single run, the
+threshold alone decides, as it does for the setup stages, which are
+measured once per invocation. The sizes of the artifacts do not vary between
+runs, so they regress when they grow by more than the threshold.
+The exit code is 1 if anything regressed, and 0 otherwise.
+"""
+
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import stats
+
+# Name of the series of the total latency in the report
+TOTAL = "Total latency"
+
+def load_results(path: Path) -> list:
+    """ Load the results-N.json files of a measurements directory, in run order, or a single one """
+    if path.is_file():
+        files = [path]
+    else:
+        files = sorted(path.glob("results-*.json"),
+                       key=lambda f: int(re.sub(r"\D", "", f.stem) or 0))
+    if not files:
+        sys.exit(f"[compare] No results-*.json in {path}")
+    results = []
+    for file in files:
+        with open(file) as f:
+            results.append(json.load(f))
+    return results
+
+def latency_samples(results: list) -> dict:
+    """
+    Latencies in seconds of each stage over the runs, and the total latency
+    of the stages of each run. The setup stages are measured once per
+    invocation and copied into the results of each of its runs, so they
+    contribute a single sample per invocation, and none to the total.
+    """
+    samples = {TOTAL: []}
+    invocations = set()
+    for i, run in enumerate(results):
+        per_stage = {stage: float(latency.rstrip("s")) for stage, latency in run["per_stage"].items()}
+        per_invocation_stages = set(run.get("per_invocation_stages", []))
+        # Results files written before the invocations were recorded are each their own
+        invocation = run.get("invocation", i)
+        new_invocation = invocation not in invocations
+        invocations.add(invocation)
+        samples[TOTAL].append(sum(latency for stage, latency in per_stage.items()
+                                  if stage not in per_invocation_stages))
+        for stage, latency in per_stage.items():
+            if stage not in per_invocation_stages or new_invocation:
+                samples.setdefault(stage, []).append(latency)
+    return samples
+
+def size_samples(results: list) -> dict:
+    """ Total size in bytes of each bandwidth artifact over the runs """
+    samples = {}
+    for run in results:
+        for artifact, breakdown in run.get("bandwidth_bytes", {}).items():
+            samples.setdefault(artifact, []).append(breakdown["total_bytes"])
+    return samples
+
+def compare(baseline: list, candidate: list, threshold: float, alpha: float,
+            significance_test: bool) -> dict:
+    """
+    Compare the samples of one stage or artifact. The verdict is
+    "regression" or "improvement" for a change beyond the threshold that is
+    significant (if tested), and "unchanged" otherwise.
+    """
+    baseline_median, candidate_median = float(np.median(baseline)), float(np.median(candidate))
+    change = candidate_median / baseline_median - 1 if baseline_median > 0 else 0.0
+    ci_low, ci_high = stats.bootstrap_relative_change_ci(baseline, candidate)
+    comparison = {
+        "baseline_median": baseline_median,
+        "candidate_median": candidate_median,
+        "relative_change": round(change, 6),
+        "ci_low": round(ci_low, 6),
+        "ci_high": round(ci_high, 6),
+        "p_value": None,
+    }
+    significant = True
+    if significance_test and len(baseline) > 1 and len(candidate) > 1:
+        _, p_value = stats.mann_whitney_u(candidate, baseline)
+        comparison["p_value"] = round(p_value, 6)
+        significant = p_value < alpha
+    if change > threshold and significant:
+        comparison["verdict"] = "regression"
+    elif change < -threshold and significant:
+        comparison["verdict"] = "improvement"
+    else:
+        comparison["verdict"] = "unchanged"
+    return comparison
+
+def compare_sets(baseline: dict, candidate: dict, threshold: float, alpha: float,
+                 significance_test: bool) -> dict:
+    """ Compare the series present in both sets, and list those present in only one """
+    report = {name: compare(baseline[name], candidate[name], threshold, alpha, significance_test)
+              for name in baseline if name in candidate}
+    report.update({name: {"verdict": "only in baseline"} for name in baseline if name not in candidate})
+    report.update({name: {"verdict": "only in candidate"} for name in candidate if name not in baseline})
+    return report
+
+def print_report(title: str, report: dict, value_format: str):
+    print(f"\n[compare] {title}")
+    print(f"[compare] {'':<62} {'baseline':>12} {'candidate':>12} {'change':>8}",
+          f"{round(100*stats.CONFIDENCE)}% CI {'':>10} {'p':>7}  verdict")
+    for name, c in report.items():
+        if "relative_change" not in c:
+            print(f"[compare] {name:<62.62} {'':>61}  {c['verdict']}")
+            continue
+        p_value = f"{c['p_value']:.4f}" if c["p_value"] is not None else "-"
+        baseline_value = format(c["baseline_median"], value_format)
+        candidate_value = format(c["candidate_median"], value_format)
+        print(f"[compare] {name:<62.62} {baseline_value:>12} {candidate_value:>12}",
+              f"{100*c['relative_change']:>+7.1f}% [{100*c['ci_low']:>+6.1f}%, {100*c['ci_high']:>+6.1f}%]",
+              f"{p_value:>7}  {c['verdict']}")
+
+def main():
+    """
+    Usage:  python3 compare_results.py  <baseline>  <candidate>  [--threshold T]  [--alpha A]  [--output FILE]
+    """
+    parser = argparse.ArgumentParser(
+        description='Compare the measurements of a candidate against a baseline. '
+                    'Exits with code 1 if any stage or artifact regressed.')
+    parser.add_argument('baseline', type=Path,
+                        help='Baseline measurements directory (e.g. a copy of measurements/small) or results file')
+    parser.add_argument('candidate', type=Path,
+                        help='Candidate measurements directory or results file')
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='Relative increase of a median beyond which it regresses (default: 0.05)')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help='Significance level of the Mann-Whitney U test (default: 0.05)')
+    parser.add_argument('--output', type=Path,
+                        help='Also write the comparison to this JSON file')
+    args = parser.parse_args()
+
+    baseline, candidate = load_results(args.baseline), load_results(args.candidate)
+    print(f"[compare] {len(baseline)} baseline runs, {len(candidate)} candidate runs")
+    if min(len(baseline), len(candidate)) > 1 and stats.min_p_value(len(baseline), len(candidate)) >= args.alpha:
+        print(f"[compare] Warning: with {len(baseline)} and {len(candidate)} runs, no change can be",
+              f"significant at alpha={args.alpha}; use more runs")
+
+    report = {
+        "baseline": str(args.baseline),
+        "candidate": str(args.candidate),
+        "threshold": args.threshold,
+        "alpha": args.alpha,
+        "confidence": stats.CONFIDENCE,
+        "latency_s": compare_sets(latency_samples(baseline), latency_samples(candidate),
+                                  args.threshold, args.alpha, significance_test=True),
+        "bandwidth_bytes": compare_sets(size_samples(baseline), size_samples(candidate),
+                                        args.threshold, args.alpha, significance_test=False),
+    }
+    print_report("Latency (median, seconds)", report["latency_s"], ".4f")
+    print_report("Bandwidth (median, bytes)", report["bandwidth_bytes"], ".0f")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = [name for section in ("latency_s", "bandwidth_bytes")
+                   for name, c in report[section].items() if c["verdict"] == "regression"]
+    if regressions:
+        print(f"\n[compare] REGRESSION in: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n[compare] No regression")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+dag.py - Run the harness steps as a graph of the artifacts they consume and produce.
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, List
+
+class Step:
+    """
+    A step of the harness: action is run once all its inputs have been
+    produced, and then provides its outputs to the next steps. Exclusive
+    steps, whose latency is measured, never run at the same time as each
+    other so that each of them is timed in isolation.
+    """
+
+    def __init__(self, name: str, action: Callable[[], None], inputs: Iterable[str] = (),
+                 outputs: Iterable[str] = (), exclusive: bool = False):
+        self.name = name
+        self.action = action
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.exclusive = exclusive
+
+def run_steps(steps: List[Step], available: Iterable[str] = (), max_workers: int = 4):
+    """
+    Run the steps, each as soon as its inputs are available and concurrently
+    with the other ready steps. Ready steps start in the order of the list.
+    The artifacts in available were produced beforehand.
+    The first exception raised by a step is re-raised once the running
+    steps are over, and the steps that are not started yet are skipped.
+    """
+    available = set(available)
+    producers = {artifact: "a previous step" for artifact in available}
+    for step in steps:
+        for output in step.outputs:
+            if output in producers:
+                raise ValueError(f"{output} is produced by both {producers[output]} and {step.name}")
+            producers[output] = step.name
+    for step in steps:
+        for input in step.inputs:
+            if input not in producers:
+                raise ValueError(f"No step produces {input}, needed by {step.name}")
+
+    exclusive_lock = threading.Lock()
+    def execute(step: Step):
+        if step.exclusive:
+            with exclusive_lock:
+                step.action()
+        else:
+            step.action()
+
+    pending = list(steps)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for step in [s for s in pending if all(i in available for i in s.inputs)]:
+                pending.remove(step)
+                running[pool.submit(execute, step)] = step
+            if not running:
+                raise ValueError(f"Steps with cyclic inputs: {', '.join(s.name for s in pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                future.result()
+                available.update(step.outputs)
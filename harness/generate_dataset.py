@@ -8,6 +8,21 @@ import sys
 from pathlib import Path
 from mnist import mnist
 
+def dataset_files(dataset_path: Path) -> list:
+    """
+    The labels and pixels files that generate_dataset writes for dataset_path.
+    """
+    base = dataset_path.with_suffix("")
+    return [base.with_name(f"{base.name}_labels.txt"), base.with_name(f"{base.name}_pixels.bin")]
+
+def generate_dataset(dataset_path: Path):
+    """
+    Export the MNIST test dataset next to dataset_path.
+    """
+    dataset_path.parent.mkdir(parents=True, exist_ok=True)
+
+    mnist.export_test_data(output_file=dataset_path, num_samples=10000, seed=None)
+
 def main():
     """
     Usage:  python3 generate_dataset.py  <output_file>
@@ -16,10 +31,7 @@ def main():
     if len(sys.argv) != 2:
         sys.exit("Usage: generate_dataset.py <output_file>")
 
-    DATASET_PATH = Path(sys.argv[1])
-    DATASET_PATH.parent.mkdir(parents=True, exist_ok=True)
-
-    mnist.export_test_data(output_file=DATASET_PATH, num_samples=10000, seed=None)
+    generate_dataset(Path(sys.argv[1]))
 
 
 if __name__ == "__main__":
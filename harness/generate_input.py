@@ -5,29 +5,43 @@ Generate a new input for each run.
 import numpy as np
 from pathlib import Path
 import utils
-from utils import parse_submission_arguments
-from mnist import mnist
+from params import InstanceParams
+from mnist import sampler
 
 
-def main():
+def generate_input(params: InstanceParams, seed: int = None, pixels_format: str = 'bin'):
     """
     Generate random value representing the query in the workload.
     """
-    size, params, seed, __, __ = parse_submission_arguments('Generate input for FHE benchmark.')
-    PIXELS_PATH = params.get_test_input_file()
+    PIXELS_PATH = utils.get_test_input_file(params, pixels_format)
     LABELS_PATH = params.get_ground_truth_labels_file()
     PIXELS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # Remove the pixels file of the other format so that the clients
+    # cannot pick up a stale input from a previous run
+    for stale_path in (params.get_test_input_file(), params.get_test_input_bin_file()):
+        if stale_path != PIXELS_PATH:
+            stale_path.unlink(missing_ok=True)
     num_samples = params.get_batch_size()
-    mnist.export_test_pixels_labels(
+    # Sample from the raw dataset files without importing torch, reusing
+    # the copy that step 1 downloaded under harness/mnist/data if needed
+    sampler.export_test_pixels_labels(
             data_dir = params.datadir(), 
             pixels_file=PIXELS_PATH, 
             labels_file=LABELS_PATH, 
             num_samples=num_samples, 
-            seed=seed)
-    
-    
+            seed=seed,
+            pixels_format=pixels_format,
+            fallback_dirs=[params.rootdir/"harness"/"mnist"/"data"])
+
 
-    
+def main():
+    """
+    Usage:  python3 generate_input.py  <size>  [--seed SEED]  [--pixels_format FORMAT]  [--run TAG]
+                                           [--batch_size N]
+    """
+    args = utils.parse_submission_options('Generate input for FHE benchmark.', run_option=True)
+    generate_input(InstanceParams(args.size, run=args.run, batch_size=args.batch_size),
+                   args.seed, args.pixels_format)
 
 
 if __name__ == "__main__":
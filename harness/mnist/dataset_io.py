@@ -0,0 +1,70 @@
+"""
+dataset_io.py - Storage format for the MNIST test pixels.
+
+The binary format is a raw little-endian array preceded by a 16-byte header:
+    bytes  0-3   magic b"FHEP"
+    bytes  4-7   uint32 format version
+    bytes  8-11  uint32 number of samples
+    bytes 12-15  uint32 number of pixels per sample
+    bytes 16-    float32 pixel values in [0, 1], one sample after the other
+The C++ clients read it back with a single bulk read (see load_dataset in
+submission/src/mlp_encryption_utils.cpp). The text format, one sample per
+line with space-separated values, is kept as a fallback.
+"""
+
+import numpy as np
+
+PIXELS_MAGIC = b"FHEP"
+PIXELS_VERSION = 1
+PIXELS_HEADER = np.dtype([("magic", "S4"), ("version", "<u4"),
+                          ("num_samples", "<u4"), ("num_pixels", "<u4")])
+PIXELS_FORMATS = ("bin", "txt")
+
+
+def write_pixels(pixels_file, pixels, pixels_format="bin"):
+    """
+    Write a (num_samples, num_pixels) matrix of pixel values to a file.
+
+    Args:
+        pixels_file (str): Path to the output file
+        pixels (array-like): Pixel values, one row per sample
+        pixels_format (str): 'bin' for the binary format, 'txt' for text
+    """
+    pixels = np.atleast_2d(np.asarray(pixels, dtype="<f4"))
+    if pixels_format == "txt":
+        np.savetxt(pixels_file, pixels, fmt="%.6f", delimiter=" ")
+    elif pixels_format == "bin":
+        header = np.array([(PIXELS_MAGIC, PIXELS_VERSION) + pixels.shape],
+                          dtype=PIXELS_HEADER)
+        with open(pixels_file, "wb") as f:
+            f.write(header.tobytes())
+            f.write(pixels.tobytes())
+    else:
+        raise ValueError(f"Unknown pixels format: {pixels_format}")
+
+
+def is_binary_pixels_file(pixels_file):
+    """Return True if the file starts with the binary pixels header."""
+    with open(pixels_file, "rb") as f:
+        return f.read(len(PIXELS_MAGIC)) == PIXELS_MAGIC
+
+
+def read_pixels(pixels_file):
+    """
+    Read a pixels file written by write_pixels, in either format.
+
+    Returns:
+        np.ndarray: (num_samples, num_pixels) float32 matrix. Binary files
+        are memory-mapped read-only rather than loaded.
+    """
+    if not is_binary_pixels_file(pixels_file):
+        return np.loadtxt(pixels_file, dtype=np.float32, ndmin=2)
+
+    header = np.fromfile(pixels_file, dtype=PIXELS_HEADER, count=1)[0]
+    if header["version"] != PIXELS_VERSION:
+        raise ValueError(f"Unsupported pixels file version {header['version']} in {pixels_file}")
+    shape = (int(header["num_samples"]), int(header["num_pixels"]))
+    if shape[0] == 0:
+        return np.empty(shape, dtype=np.float32)
+    return np.memmap(pixels_file, dtype="<f4", mode="r",
+                     offset=PIXELS_HEADER.itemsize, shape=shape)
@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -13,6 +14,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 import model as simple_ffn
 import train
 import test
+import dataset_io
 
 FLAGS = flags.FLAGS
 
@@ -23,6 +25,9 @@ EPOCHS = 15 # Increased epochs for potentially better accuracy
 MODEL_PATH = './harness/mnist/mnist_ffnn_model.pth'
 RNG_SEED = 42 # for reproducibility
 DATA_DIR='./harness/mnist/data'
+# MNIST dataset's mean and std, used to normalize the pixels
+MNIST_MEAN = 0.1307
+MNIST_STD = 0.3081
 
 # Define command line flags
 flags.DEFINE_string('model_path', MODEL_PATH, 'Path to save/load the model')
@@ -32,10 +37,13 @@ flags.DEFINE_integer('epochs', EPOCHS, 'Number of training epochs')
 flags.DEFINE_string('data_dir', './harness/mnist/data', 'Directory to store/load MNIST dataset')
 flags.DEFINE_boolean('no_cuda', False, 'Disable CUDA even if available')
 flags.DEFINE_integer('seed', RNG_SEED, 'Random seed for reproducibility')
+flags.DEFINE_boolean('fast_train', True, 'Train on the dataset decoded once into memory instead of through DataLoader')
+flags.DEFINE_integer('num_threads', 0, 'Number of intra-op threads for fast training (0 for all the available CPUs)')
 
 flags.DEFINE_boolean('export_test_data', False, 'Export test dataset to file and exit')
 flags.DEFINE_string('test_data_output', 'mnist_test.txt', 'Output file for exported test data')
 flags.DEFINE_integer('num_samples', -1, 'Number of samples to export (-1 for all samples)')
+flags.DEFINE_enum('pixels_format', 'bin', dataset_io.PIXELS_FORMATS, 'Format of the exported pixels file')
 
 flags.DEFINE_boolean('predict', False, 'Run prediction on pixels file and exit')
 flags.DEFINE_string('pixels_file', '', 'Path to file containing pixel data for prediction')
@@ -56,7 +64,7 @@ def get_mnist_transform():
     """
     return transforms.Compose([
         transforms.ToTensor(), # Converts PIL Image or numpy.ndarray to FloatTensor and scales to [0.0, 1.0]
-        transforms.Normalize((0.1307,), (0.3081,)) # Normalize with MNIST dataset's mean and std
+        transforms.Normalize((MNIST_MEAN,), (MNIST_STD,)) # Normalize with MNIST dataset's mean and std
     ])
 
 def load_and_preprocess_data(batch_size=BATCH_SIZE, data_dir=DATA_DIR):
@@ -86,6 +94,36 @@ def load_and_preprocess_data(batch_size=BATCH_SIZE, data_dir=DATA_DIR):
     test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
     
     return train_loader, val_loader, test_loader
+
+def load_mnist_tensors(data_dir=DATA_DIR, device="cpu"):
+    """
+    Decode the MNIST dataset once into normalized in-memory tensors, with the
+    values that get_mnist_transform gives sample by sample.
+
+    Args:
+        data_dir (str): Directory to store/load dataset
+        device (str): Device to hold the tensors
+
+    Returns:
+        tuple: (train_set, val_set, test_set), each a (data, targets) pair of tensors,
+        with data of shape (num_samples, 784), split as in load_and_preprocess_data
+    """
+    def decode(train):
+        dataset = datasets.MNIST(data_dir, train=train, download=True)
+        data = dataset.data.reshape(len(dataset.data), -1).float().div_(255)
+        data.sub_(MNIST_MEAN).div_(MNIST_STD)
+        return data.to(device), dataset.targets.to(device)
+
+    full_data, full_targets = decode(train=True)
+    test_set = decode(train=False)
+
+    # Split training data into training and validation sets
+    train_size = int(0.8 * len(full_data))
+    indices = torch.randperm(len(full_data), device=device)
+    train_indices, val_indices = indices[:train_size], indices[train_size:]
+    train_set = (full_data[train_indices], full_targets[train_indices])
+    val_set = (full_data[val_indices], full_targets[val_indices])
+    return train_set, val_set, test_set
     
 
 # 3. Model Definition: See model.py
@@ -103,13 +141,34 @@ def train_model(model_path, batch_size, learning_rate, epochs, train_loader, val
     else:
         train.train_model(model, train_loader, val_loader, criterion, optimizer, epochs, device, model_path)
     return model
+
+def train_model_fast(model_path, batch_size, learning_rate, epochs, train_set, val_set, device,
+                     num_threads=0):
+    """
+    Same as train_model, on the in-memory datasets of load_mnist_tensors,
+    with num_threads intra-op threads (0 for all the available CPUs).
+    """
+    model = simple_ffn.SimpleFFNN().to(device)
+    criterion = nn.CrossEntropyLoss() # Suitable for classification tasks
+    # Adam optimizer, updating all the parameters in a single fused kernel
+    optimizer = optim.Adam(model.parameters(), lr=learning_rate, fused=True)
+
+    # Train the model if it does not exist
+    if os.path.exists(model_path):
+        model.load_state_dict(torch.load(model_path, map_location=device))
+    else:
+        available_cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        torch.set_num_threads(num_threads or available_cpus)
+        train.train_model_in_memory(model, train_set, val_set, criterion, optimizer, epochs, batch_size,
+                                    model_path)
+    return model
     
 
 # 5. Testing Function: See test.py
 
 
 # Function to export test data to separate files.
-def export_test_pixels_labels(data_dir=DATA_DIR, pixels_file="mnist_pixels.txt", labels_file="mnist_labels.txt", num_samples=-1, seed=None):
+def export_test_pixels_labels(data_dir=DATA_DIR, pixels_file="mnist_pixels.bin", labels_file="mnist_labels.txt", num_samples=-1, seed=None, pixels_format="bin"):
     """
     Export MNIST test dataset to separate label and pixel files using random sampling.
     
@@ -118,61 +177,34 @@ def export_test_pixels_labels(data_dir=DATA_DIR, pixels_file="mnist_pixels.txt",
         pixels_file (str): Path to the output file for pixel values
         labels_file (str): Path to the output file for labels
         num_samples (int): Number of samples to export (-1 for all)
+        pixels_format (str): 'bin' for the binary pixels format, 'txt' for text (see dataset_io.py)
     """
     if seed is not None:
         torch.manual_seed(seed)
 
     # Get the total number of samples in the test dataset
-    transform = transforms.Compose([
-        transforms.ToTensor(), # Converts PIL Image or numpy.ndarray to FloatTensor and scales to [0.0, 1.0]
-    ])
-    test_dataset = datasets.MNIST(data_dir, train=False, download=True, transform=transform)
+    test_dataset = datasets.MNIST(data_dir, train=False, download=True)
     total_samples = len(test_dataset)
 
     # Determine how many samples to export
     samples_to_export = total_samples if num_samples == -1 else min(num_samples, total_samples)
     
-    
-    # Use sample_test_data to get random samples (but without normalization for export)
     if samples_to_export == total_samples:
-        
-        with open(labels_file, 'w') as label_f, open(pixels_file, 'w') as pixel_f:
-            for image, label in test_dataset:
-                # Flatten the image to 784 dimensions (28x28)
-                flattened_image = image.view(-1).numpy()
-                
-                # Write label to labels file
-                label_f.write(f"{label}\n")
-                
-                # Write pixel values to pixels file
-                pixel_values = " ".join(f"{pixel:.6f}" for pixel in flattened_image)
-                pixel_f.write(f"{pixel_values}\n")
+        indices = torch.arange(total_samples)
     else:
-        
         # Generate random indices
-        random_indices = torch.randperm(total_samples)[:samples_to_export]
-        
-        # Create a subset dataset using the random indices
-        subset_dataset = torch.utils.data.Subset(test_dataset, random_indices)
-        
-        # Create DataLoader for the subset
-        subset_loader = DataLoader(subset_dataset, batch_size=1, shuffle=False)
-        
-        with open(labels_file, 'w') as label_f, open(pixels_file, 'w') as pixel_f:
-            for batch_images, batch_labels in subset_loader:
-                for image, label in zip(batch_images, batch_labels):
-                    # Flatten the image to 784 dimensions (28x28)
-                    flattened_image = image.view(-1).numpy()
-                    
-                    # Write label to labels file
-                    label_f.write(f"{label.item()}\n")
-                    
-                    # Write pixel values to pixels file
-                    pixel_values = " ".join(f"{pixel:.6f}" for pixel in flattened_image)
-                    pixel_f.write(f"{pixel_values}\n")
-
-
-def export_test_data(data_dir=DATA_DIR, output_file='mnist_test.txt', num_samples=-1, seed=None):
+        indices = torch.randperm(total_samples)[:samples_to_export]
+
+    # Index the raw uint8 images directly and scale them to [0.0, 1.0] in one
+    # tensor op, which matches transforms.ToTensor (but without normalization for export)
+    pixels = test_dataset.data[indices].reshape(len(indices), -1).float().div(255)
+    labels = test_dataset.targets[indices]
+
+    np.savetxt(labels_file, labels.numpy(), fmt="%d")
+    dataset_io.write_pixels(pixels_file, pixels.numpy(), pixels_format)
+
+
+def export_test_data(data_dir=DATA_DIR, output_file='mnist_test.txt', num_samples=-1, seed=None, pixels_format="bin"):
     """
     Export MNIST test dataset to separate label and pixel files using random sampling.
     
@@ -180,23 +212,36 @@ def export_test_data(data_dir=DATA_DIR, output_file='mnist_test.txt', num_sample
         data_dir (str): Directory to load dataset from
         output_file (str): Base output file path (will create .labels and .pixels files)
         num_samples (int): Number of samples to export (-1 for all)
+        pixels_format (str): 'bin' for the binary pixels format, 'txt' for text (see dataset_io.py)
     """
     # Create separate file names for labels and pixels
     base_name = str(output_file).rsplit('.', 1)[0] if '.' in str(output_file) else str(output_file)
     labels_file = f"{base_name}_labels.txt"
-    pixels_file = f"{base_name}_pixels.txt"
-    export_test_pixels_labels(data_dir=data_dir, pixels_file=pixels_file, labels_file=labels_file, num_samples=num_samples, seed=seed)
+    pixels_file = f"{base_name}_pixels.{pixels_format}"
+    export_test_pixels_labels(data_dir=data_dir, pixels_file=pixels_file, labels_file=labels_file, num_samples=num_samples, seed=seed, pixels_format=pixels_format)
 
 
-def run_predict(model_path, pixels_file, predictions_file, device="cpu"):
+def ensure_model(model_path, device="cpu", fast_train=True):
     """
-    Run prediction on the given pixel file using the specified model.
+    Train the model and save it to model_path if it does not exist.
     """
-    if not os.path.exists(model_path):
+    if not os.path.exists(model_path) and fast_train:
+        train_set, val_set, _ = load_mnist_tensors(data_dir=DATA_DIR, device=device)
+        _ = train_model_fast(model_path, batch_size=BATCH_SIZE, learning_rate=LEARNING_RATE,
+                             epochs=EPOCHS, train_set=train_set, val_set=val_set, device=device)
+    elif not os.path.exists(model_path):
         train_loader, val_loader, test_loader = load_and_preprocess_data(batch_size=BATCH_SIZE, data_dir=DATA_DIR)
         _ = train_model(model_path, batch_size=BATCH_SIZE, learning_rate=LEARNING_RATE,
                     epochs=EPOCHS, train_loader=train_loader, val_loader=val_loader,
                     data_dir=DATA_DIR, device=device)
+
+
+def run_predict(model_path, pixels_file, predictions_file, device="cpu", fast_train=True):
+    """
+    Run prediction on the given pixel file using the specified model,
+    training it first if it does not exist.
+    """
+    ensure_model(model_path, device=device, fast_train=fast_train)
     test.predict(pixels_file, model_path, predictions_file, device=device)
 
 
@@ -205,7 +250,8 @@ def main(argv):
     # Check if we should just export test data and exit
     if FLAGS.export_test_data:
         print("Export mode: Loading and exporting test data...")
-        export_test_data(data_dir=FLAGS.data_dir, output_file=FLAGS.test_data_output, num_samples=FLAGS.num_samples)
+        export_test_data(data_dir=FLAGS.data_dir, output_file=FLAGS.test_data_output, num_samples=FLAGS.num_samples,
+                         pixels_format=FLAGS.pixels_format)
         print("Export completed. Exiting.")
         return
     
@@ -218,9 +264,15 @@ def main(argv):
         torch.cuda.manual_seed_all(random_seed)
     device = "cuda" if use_cuda else "cpu"
     # Train the model.
-    train_loader, val_loader, test_loader = load_and_preprocess_data(batch_size=FLAGS.batch_size, data_dir=FLAGS.data_dir)
-    model = train_model(FLAGS.model_path, FLAGS.batch_size, FLAGS.learning_rate, 
-            FLAGS.epochs, train_loader, val_loader, data_dir, device=device)
+    if FLAGS.fast_train:
+        train_set, val_set, (test_data, test_targets) = load_mnist_tensors(data_dir=FLAGS.data_dir, device=device)
+        model = train_model_fast(FLAGS.model_path, FLAGS.batch_size, FLAGS.learning_rate,
+                                 FLAGS.epochs, train_set, val_set, device=device, num_threads=FLAGS.num_threads)
+        test_loader = list(zip(test_data.split(FLAGS.batch_size), test_targets.split(FLAGS.batch_size)))
+    else:
+        train_loader, val_loader, test_loader = load_and_preprocess_data(batch_size=FLAGS.batch_size, data_dir=FLAGS.data_dir)
+        model = train_model(FLAGS.model_path, FLAGS.batch_size, FLAGS.learning_rate, 
+                FLAGS.epochs, train_loader, val_loader, FLAGS.data_dir, device=device)
 
     # Check if we should run prediction and exit
     if FLAGS.predict:
@@ -228,7 +280,7 @@ def main(argv):
             print("Error: pixels_file must be specified when using --predict flag")
             return
         print("Prediction mode: Running inference on provided pixel data...")
-        run_predict(FLAGS.model_path, FLAGS.pixels_file, FLAGS.predictions_file)
+        run_predict(FLAGS.model_path, FLAGS.pixels_file, FLAGS.predictions_file, fast_train=FLAGS.fast_train)
         print("Prediction completed. Exiting.")
         return
     else:
@@ -0,0 +1,112 @@
+"""
+sampler.py - Torch-free sampling of the MNIST test set.
+
+Memory-maps the raw IDX files that torchvision leaves under
+<data_dir>/MNIST/raw and draws a seeded sample with numpy, so that the
+per-run input generation does not need to import torch.
+"""
+
+import numpy as np
+from pathlib import Path
+
+from . import dataset_io
+
+TEST_IMAGES_FILE = "t10k-images-idx3-ubyte"
+TEST_LABELS_FILE = "t10k-labels-idx1-ubyte"
+
+# IDX type codes, see http://yann.lecun.com/exdb/mnist/
+IDX_DTYPES = {
+    0x08: np.dtype("u1"),
+    0x09: np.dtype("i1"),
+    0x0B: np.dtype(">i2"),
+    0x0C: np.dtype(">i4"),
+    0x0D: np.dtype(">f4"),
+    0x0E: np.dtype(">f8"),
+}
+
+
+def read_idx(path):
+    """
+    Memory-map an IDX file.
+
+    Args:
+        path (str): Path to the (uncompressed) IDX file
+
+    Returns:
+        np.memmap: Read-only array with the shape stored in the file header
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+        if len(magic) != 4 or magic[0] != 0 or magic[1] != 0 or magic[2] not in IDX_DTYPES:
+            raise ValueError(f"Not an IDX file: {path}")
+        ndim = magic[3]
+        shape = tuple(int(d) for d in np.frombuffer(f.read(4 * ndim), dtype=">u4"))
+    return np.memmap(path, dtype=IDX_DTYPES[magic[2]], mode="r",
+                     offset=4 + 4 * ndim, shape=shape)
+
+
+def find_raw_dir(data_dirs):
+    """Return the first <data_dir>/MNIST/raw directory holding the test set, or None."""
+    for data_dir in data_dirs:
+        raw_dir = Path(data_dir) / "MNIST" / "raw"
+        if (raw_dir / TEST_IMAGES_FILE).exists() and (raw_dir / TEST_LABELS_FILE).exists():
+            return raw_dir
+    return None
+
+
+def load_test_set(data_dir, fallback_dirs=()):
+    """
+    Memory-map the MNIST test images and labels.
+
+    Args:
+        data_dir (str): Directory to store/load the dataset
+        fallback_dirs (list): Other directories that may already hold the dataset
+
+    Returns:
+        tuple: (images, labels) with images of shape (num_samples, 784)
+    """
+    raw_dir = find_raw_dir([data_dir, *fallback_dirs])
+    if raw_dir is None:
+        # Only the very first run has to download the dataset
+        from torchvision import datasets
+        datasets.MNIST(data_dir, train=False, download=True)
+        raw_dir = find_raw_dir([data_dir])
+
+    images = read_idx(raw_dir / TEST_IMAGES_FILE)
+    labels = read_idx(raw_dir / TEST_LABELS_FILE)
+    return images.reshape(len(images), -1), labels
+
+
+def sample_indices(total_samples, num_samples=-1, seed=None):
+    """
+    Return the indices of the exported samples: all of them in order, or a
+    random subset that only depends on the seed.
+    """
+    if num_samples == -1 or num_samples >= total_samples:
+        return np.arange(total_samples)
+    rng = np.random.default_rng(seed)
+    return rng.permutation(total_samples)[:num_samples]
+
+
+def export_test_pixels_labels(data_dir, pixels_file, labels_file, num_samples=-1, seed=None,
+                              pixels_format="bin", fallback_dirs=()):
+    """
+    Export a random sample of the MNIST test dataset to separate label and pixel files.
+
+    Args:
+        data_dir (str): Directory to store/load the dataset
+        pixels_file (str): Path to the output file for pixel values
+        labels_file (str): Path to the output file for labels
+        num_samples (int): Number of samples to export (-1 for all)
+        seed (int): Seed of the sample, None for a fresh one
+        pixels_format (str): 'bin' for the binary pixels format, 'txt' for text (see dataset_io.py)
+        fallback_dirs (list): Other directories that may already hold the dataset
+    """
+    images, labels = load_test_set(data_dir, fallback_dirs)
+    indices = sample_indices(len(images), num_samples, seed)
+
+    # Scale to [0.0, 1.0] like transforms.ToTensor
+    pixels = images[indices].astype(np.float32) / np.float32(255)
+
+    np.savetxt(labels_file, labels[indices], fmt="%d")
+    dataset_io.write_pixels(pixels_file, pixels, pixels_format)
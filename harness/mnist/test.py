@@ -2,6 +2,7 @@
 import os
 import torch
 import model as simple_ffn
+import dataset_io
 
 def test_model(model, test_loader, device):
     model.eval() # Set model to evaluation mode
@@ -24,7 +25,7 @@ def predict(pixels_file, model_path="mnist_ffnn_model.pth", predictions_file='pr
     Load a trained model and make predictions on pixel data from a file.
     
     Args:
-        pixels_file (str): Path to file containing pixel data (one sample per line, 784 values per line)
+        pixels_file (str): Path to file containing pixel data (784 values per sample, see dataset_io.py)
         model_path (str): Path to the trained model file
         predictions_file (str): Path to save the predictions
         device (str): Device to run inference on ('cpu' or 'cuda')
@@ -43,15 +44,10 @@ def predict(pixels_file, model_path="mnist_ffnn_model.pth", predictions_file='pr
     model.load_state_dict(torch.load(model_path, map_location=device))
     model.eval()  # Set model to evaluation mode
     
-    # Read pixel data from file
-    pixel_data = []
-    with open(pixels_file, 'r') as f:
-        for line in f:
-            # Parse the line and convert to float values
-            pixel_values = [float(x) for x in line.strip().split()]
-            if len(pixel_values) != 784:
-                raise ValueError(f"Each line must contain exactly 784 pixel values, got {len(pixel_values)}")
-            pixel_data.append(pixel_values)
+    # Read pixel data from file (memory-mapped if it is in the binary format)
+    pixel_data = dataset_io.read_pixels(pixels_file)
+    if pixel_data.shape[1] != 784:
+        raise ValueError(f"Each sample must contain exactly 784 pixel values, got {pixel_data.shape[1]}")
     
     # Convert to tensor and apply normalization (same as training)
     # The pixel values should already be normalized (0-1), but we need to apply MNIST normalization
@@ -1,3 +1,4 @@
+import time
 import torch
 
 def train_model(model, train_loader, val_loader, criterion, optimizer, epochs, device, model_path):
@@ -46,4 +47,58 @@ def train_model(model, train_loader, val_loader, criterion, optimizer, epochs, d
         if val_accuracy > best_accuracy:
             best_accuracy = val_accuracy
             torch.save(model.state_dict(), model_path)
-            print(f'Model saved to {model_path} with validation accuracy: {best_accuracy:.2f}%')
\ No newline at end of file
+            print(f'Model saved to {model_path} with validation accuracy: {best_accuracy:.2f}%')
+
+
+def train_model_in_memory(model, train_set, val_set, criterion, optimizer, epochs, batch_size, model_path):
+    """
+    Same training as train_model, on datasets held in memory as (data, targets)
+    tensors (see mnist.load_mnist_tensors). Each epoch shuffles the training
+    set with a random permutation whose slices index the batches, and the
+    metrics are accumulated on the device of the tensors, so that they are
+    only read back once per epoch.
+    """
+    train_data, train_targets = train_set
+    val_data, val_targets = val_set
+    device = train_data.device
+    num_batches = (len(train_data) + batch_size - 1) // batch_size
+    best_accuracy = 0.0
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        epoch_start = time.perf_counter()
+        model.train() # Set model to training mode
+        running_loss = torch.zeros((), device=device)
+        correct_train = torch.zeros((), dtype=torch.long, device=device)
+        for indices in torch.randperm(len(train_data), device=device).split(batch_size):
+            data, target = train_data[indices], train_targets[indices]
+
+            optimizer.zero_grad() # Zero the gradients
+            output = model(data)  # Forward pass
+            loss = criterion(output, target) # Calculate loss
+            loss.backward()       # Backward pass
+            optimizer.step()      # Update weights
+
+            running_loss += loss.detach()
+            correct_train += (output.argmax(1) == target).sum()
+
+        train_accuracy = 100 * correct_train.item() / len(train_data)
+        epoch_seconds = time.perf_counter() - epoch_start
+        print(f'Epoch {epoch+1}/{epochs}, Loss: {running_loss.item()/num_batches:.4f}, '
+              f'Train Accuracy: {train_accuracy:.2f}% ({1/epoch_seconds:.2f} epochs/s)')
+
+        # Validation phase, on the whole validation set at once
+        model.eval() # Set model to evaluation mode
+        with torch.no_grad(): # Disable gradient calculation during validation
+            output = model(val_data)
+            val_loss = criterion(output, val_targets).item()
+            val_accuracy = 100 * (output.argmax(1) == val_targets).sum().item() / len(val_data)
+        print(f'Validation Loss: {val_loss:.4f}, Validation Accuracy: {val_accuracy:.2f}%')
+
+        # Save the model if it's the best so far
+        if val_accuracy > best_accuracy:
+            best_accuracy = val_accuracy
+            torch.save(model.state_dict(), model_path)
+            print(f'Model saved to {model_path} with validation accuracy: {best_accuracy:.2f}%')
+
+    total_seconds = time.perf_counter() - start
+    print(f'Trained {epochs} epochs in {total_seconds:.2f}s ({epochs/total_seconds:.2f} epochs/s)')
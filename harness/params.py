@@ -11,6 +11,10 @@ SMALL = 1
 MEDIUM = 2
 LARGE = 3
 
+# Largest batch size: the number of samples of the MNIST test set, from which
+# the batches are drawn
+MAX_BATCH_SIZE = 10000
+
 def instance_name(size):
     """Return the string name of the instance size."""
     if size > LARGE:
@@ -21,22 +25,37 @@ def instance_name(size):
 class InstanceParams:
     """Parameters that differ for different instance sizes."""
 
-    def __init__(self, size, rootdir=None):
-        """Constructor."""
+    def __init__(self, size, rootdir=None, run=None, batch_size=None):
+        """
+        Constructor. The inputs and outputs of a tagged run are kept in
+        their own sub-directories, so that runs can overlap; the keys
+        are shared by all runs. A custom batch_size replaces that of the
+        instance size, and its instance has its own directories.
+        """
         self.size = size
         self.rootdir = Path(rootdir) if rootdir else Path.cwd()
+        self.run = run
 
         if size > LARGE:
             raise ValueError("Invalid instance size")
+        if batch_size is not None and not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError("Invalid batch size")
         
-        batch_size =              [1, 15, 1000, 10000]
+        batch_sizes =             [1, 15, 1000, 10000]
 
-        self.batch_size = batch_size[size]
+        self.custom_batch = batch_size is not None
+        self.batch_size = batch_size if self.custom_batch else batch_sizes[size]
 
     def get_size(self):
         """Return the instance size."""
         return self.size
 
+    def get_name(self):
+        """Return the name of the instance directories."""
+        if self.custom_batch:
+            return f"batch-{self.batch_size}"
+        return instance_name(self.size)
+
     # Directory structure methods
     def subdir(self):
         """Return the submission directory of this repository."""
@@ -44,23 +63,35 @@ class InstanceParams:
 
     def datadir(self):
         """Return the dataset directory path."""
-        return self.rootdir / "datasets" / instance_name(self.size)
+        return self.rootdir / "datasets" / self.get_name()
     
     def dataset_intermediate_dir(self):
         """Return the intermediate  directory path."""
+        if self.run:
+            return self.datadir() / "intermediate" / self.run
         return self.datadir() / "intermediate"
 
     def iodir(self):
         """Return the I/O directory path."""
-        return self.rootdir / "io" / instance_name(self.size)
+        return self.rootdir / "io" / self.get_name()
+
+    def run_iodir(self):
+        """Return the I/O directory path of the ciphertexts and results of the run."""
+        if self.run:
+            return self.iodir() / "runs" / self.run
+        return self.iodir()
 
     def io_intermediate_dir(self):
         """Return the intermediate  directory path."""
-        return self.iodir() / "intermediate"
+        return self.run_iodir() / "intermediate"
+
+    def cachedir(self):
+        """Return the directory of the caches kept across invocations."""
+        return self.rootdir / "cache"
 
     def measuredir(self):
         """Return the measurements directory path."""
-        return self.rootdir / "measurements" / instance_name(self.size)
+        return self.rootdir / "measurements" / self.get_name()
     
     def get_batch_size(self):
         """Return the number of items in the batch."""
@@ -70,14 +101,22 @@ class InstanceParams:
         """Return the test input file path."""
         return self.dataset_intermediate_dir() / "test_pixels.txt"
 
+    def get_test_input_bin_file(self):
+        """Return the binary (memory-mappable) test input file path."""
+        return self.dataset_intermediate_dir() / "test_pixels.bin"
+
     def get_ground_truth_labels_file(self):
         """Return the ground truth labels file path."""
         return self.dataset_intermediate_dir() / "test_labels.txt"
 
     def get_encrypted_model_predictions_file(self):
         """Return the encrypted model predictions file path."""
-        return self.iodir() / "encrypted_model_predictions.txt"
+        return self.run_iodir() / "encrypted_model_predictions.txt"
+
+    def get_encrypted_model_predictions_shard_file(self, begin, end):
+        """Return the encrypted model predictions file path of the samples [begin, end)."""
+        return self.run_iodir() / f"encrypted_model_predictions_{begin}-{end}.txt"
 
     def get_harness_model_predictions_file(self):
         """Return the harness model predictions file path."""
-        return self.iodir() / "harness_model_predictions.txt"
+        return self.run_iodir() / "harness_model_predictions.txt"
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+run_matrix.py - Run a matrix of instance sizes and seeds concurrently, each on its own CPUs.
+
+Splits the CPUs this process may run on into disjoint sets of whole
+physical cores, one per slot, and runs the whole submission
+(run_submission.py) of each instance of the matrix in a free slot, pinned
+to its CPUs (taskset -c) with OMP_NUM_THREADS set to their
+number, so that concurrent instances neither share cores nor oversubscribe
+them. Instances of the same size share their io and measurements
+directories, so they never run at the same time. Every results file
+records the CPUs it ran on under host/cpu_affinity. The measurements of
+each instance are copied to measurements/matrix/<instance>/, next to its
+log and to matrix.json, which lists the instances with their CPUs,
+exit code and wall time.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from params import InstanceParams, SINGLE, LARGE
+import cleartext_impl
+import utils
+
+def parse_list(text: str) -> list:
+    """ Parse a comma-separated list of integers, e.g. 0,1,2 """
+    try:
+        return [int(v) for v in text.split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid list: {text}")
+
+def physical_cores(cpus: list) -> list:
+    """
+    Group the CPUs into physical cores, as lists of hyper-threads, so that
+    no two slots share a core. Each CPU is its own core where the topology
+    is not available.
+    """
+    cores = {}
+    for cpu in cpus:
+        try:
+            siblings = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list").read_text()
+            core = min(parse_cpu_list(siblings))
+        except (OSError, ValueError):
+            core = cpu
+        cores.setdefault(core, []).append(cpu)
+    return [sorted(threads) for _, threads in sorted(cores.items())]
+
+def parse_cpu_list(text: str) -> list:
+    """ Parse a Linux CPU list, e.g. 0-3,8 """
+    cpus = []
+    for part in text.strip().split(","):
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def cpu_slots(num_slots: int) -> list:
+    """
+    Split the available CPUs into num_slots disjoint sets of consecutive
+    physical cores, as even as possible
+    """
+    cores = physical_cores(utils.cpu_affinity() or list(range(os.cpu_count())))
+    if num_slots > len(cores):
+        sys.exit(f"[matrix] {num_slots} slots need as many physical cores, only {len(cores)} are available")
+    slots = []
+    begin = 0
+    for slot in range(num_slots):
+        end = begin + len(cores) // num_slots + (slot < len(cores) % num_slots)
+        slots.append([cpu for core in cores[begin:end] for cpu in core])
+        begin = end
+    return slots
+
+def instance_label(params: InstanceParams, seed) -> str:
+    return params.get_name() if seed is None else f"{params.get_name()}-seed-{seed}"
+
+def main():
+    """
+    Usage:  python3 run_matrix.py  [--sizes 0,1,2,3]  [--seeds S1,S2,...]  [--slots K]
+                                   [run_submission.py options]
+    """
+    parser = argparse.ArgumentParser(
+        description='Run the ML Inference FHE benchmark for several instance sizes and seeds '
+                    'concurrently, each pinned to its own CPUs. '
+                    'The other options are passed on to run_submission.py.')
+    parser.add_argument('--sizes', type=parse_list, default=list(range(SINGLE, LARGE+1)),
+                        help='Comma-separated instance sizes to run (default: 0,1,2,3)')
+    parser.add_argument('--seeds', type=parse_list, default=[None],
+                        help='Comma-separated seeds to run each size with (default: no seed)')
+    parser.add_argument('--slots', type=int,
+                        help='Number of instances running at the same time, each on an equal share '
+                             'of the physical cores (default: the number of sizes)')
+    args, submission_options = parser.parse_known_args()
+    if any(size not in range(SINGLE, LARGE+1) for size in args.sizes):
+        parser.error('the sizes must be between 0 and 3')
+    if "--seed" in submission_options:
+        parser.error('use --seeds to set the seeds')
+    num_slots = args.slots or len(set(args.sizes))
+    if num_slots < 1:
+        parser.error('--slots must be at least 1')
+    batch_size = None
+    if "--batch_size" in submission_options:
+        if len(set(args.sizes)) > 1:
+            parser.error('with --batch_size, all the sizes share the same directories; run a single size')
+        batch_size = int(submission_options[submission_options.index("--batch_size") + 1])
+
+    if shutil.which("taskset") is None:
+        sys.exit("[matrix] taskset (util-linux) is needed to pin the instances to their CPUs")
+    harness_dir = Path(__file__).resolve().parent
+    rootdir = Path.cwd()
+    utils.ensure_directories(rootdir)
+    # Build the submission and train the harness model once, on all the
+    # CPUs, rather than concurrently in every instance
+    utils.build_submission(rootdir/"scripts", InstanceParams(SINGLE, rootdir).cachedir()/"manifests")
+    cleartext_impl.ensure_model()
+    matrix_dir = rootdir / "measurements" / "matrix"
+    matrix_dir.mkdir(parents=True, exist_ok=True)
+
+    pending = [(size, seed) for seed in dict.fromkeys(args.seeds) for size in dict.fromkeys(args.sizes)]
+    running_sizes = set()
+    instances = []
+    condition = threading.Condition()
+
+    def next_instance():
+        """ The first pending instance whose size is not running, waiting for one if needed """
+        with condition:
+            while True:
+                if not pending:
+                    return None
+                for size, seed in pending:
+                    if size not in running_sizes:
+                        pending.remove((size, seed))
+                        running_sizes.add(size)
+                        return size, seed
+                condition.wait()
+
+    def run_instance(size, seed, cpus):
+        params = InstanceParams(size, rootdir, batch_size=batch_size)
+        label = instance_label(params, seed)
+        # Pinned by taskset rather than in a preexec_fn, which is not safe to
+        # run in a child forked from a threaded process
+        cmd = ["taskset", "-c", ",".join(map(str, cpus)),
+               sys.executable, harness_dir/"run_submission.py", str(size), "--skip_build",
+               *(["--seed", str(seed)] if seed is not None else []), *submission_options]
+        print(f"[matrix] Starting {label} on CPUs {','.join(map(str, cpus))}", flush=True)
+        start = time.perf_counter()
+        with open(matrix_dir / f"{label}.log", "w") as log:
+            returncode = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT,
+                                        env={**os.environ, "OMP_NUM_THREADS": str(len(cpus))}).returncode
+        elapsed = time.perf_counter() - start
+        # The next instance of the same size overwrites the measurements
+        shutil.rmtree(matrix_dir / label, ignore_errors=True)
+        if params.measuredir().exists():
+            shutil.copytree(params.measuredir(), matrix_dir / label)
+        status = "done" if returncode == 0 else f"FAILED (exit code {returncode}, see {label}.log)"
+        print(f"[matrix] {label} {status} in {elapsed:.2f}s", flush=True)
+        with condition:
+            running_sizes.discard(size)
+            instances.append({
+                "instance": label,
+                "size": size,
+                "seed": seed,
+                "cpus": cpus,
+                "omp_num_threads": len(cpus),
+                "returncode": returncode,
+                "wall_time_s": round(elapsed, 4),
+            })
+            condition.notify_all()
+
+    def run_slot(cpus):
+        while (instance := next_instance()) is not None:
+            run_instance(*instance, cpus)
+
+    start = time.perf_counter()
+    slots = [threading.Thread(target=run_slot, args=(cpus,)) for cpus in cpu_slots(num_slots)]
+    for slot in slots:
+        slot.start()
+    for slot in slots:
+        slot.join()
+    wall_time = time.perf_counter() - start
+
+    sequential_time = sum(instance["wall_time_s"] for instance in instances)
+    with open(matrix_dir / "matrix.json", "w") as f:
+        json.dump({
+            "slots": num_slots,
+            "wall_time_s": round(wall_time, 4),
+            "sum_of_instance_wall_times_s": round(sequential_time, 4),
+            "host": {key: value for key, value in utils.host_info().items()
+                     if key in ("cpu_model", "num_cpus", "available_cpus", "cpu_affinity")},
+            "instances": sorted(instances, key=lambda instance: (instance["size"], str(instance["seed"]))),
+        }, f, indent=2)
+
+    print(f"\n[matrix] {len(instances)} instances in {wall_time:.2f}s",
+          f"(sum of their wall times: {sequential_time:.2f}s)")
+    print(f"[matrix] Measurements written to {matrix_dir}")
+    if any(instance["returncode"] != 0 for instance in instances):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,29 @@ run_submission.py - run the entire submission process, from build to verify
 
 # TODO: Add license and copyright
 
+import atexit
+import os
+import shutil
 import subprocess
 import sys
 import numpy as np
+import cache
+import dag
+import tracing
 import utils
-from params import instance_name
+from params import InstanceParams
+from server_daemon import ServerDaemon
+from mnist import sampler
+# The Python harness steps, imported once and run in-process unless --subprocess is given
+import generate_dataset
+import generate_input
+import cleartext_impl
+import verify_result
+
+# Size bound of the harness model predictions cache
+CLEARTEXT_CACHE_BYTES = 64 << 20
+# Sources of the test dataset generation of step 1, relative to the harness
+DATASET_SOURCES = ["generate_dataset.py", "mnist/mnist.py", "mnist/dataset_io.py"]
 
 def main():
     """
@@ -18,113 +36,426 @@ def main():
     
     # 0. Prepare running
     # Get the arguments
-    size, params, seed, num_runs, clrtxt = utils.parse_submission_arguments('Run ML Inference FHE benchmark.')
-    test = instance_name(size)
+    args = utils.parse_submission_options('Run ML Inference FHE benchmark.')
+    size, seed, num_runs, clrtxt = args.size, args.seed, args.num_runs, args.clrtxt
+    num_warmup = args.warmup
+    pipeline = args.pipeline
+    stream, stream_depth = args.stream, args.stream_depth
+    custom_batch_size = args.batch_size
+    workers = args.workers
+    key_cache = args.key_cache
+    server_daemon = args.server_daemon
+    pixels_format = args.pixels_format
+    isolated = args.subprocess
+    params = InstanceParams(size, batch_size=custom_batch_size)
+    test = params.get_name()
+    # A batch of one sample is checked against its label, larger ones for their
+    # accuracy, whatever the instance size whose parameters are used
+    single = params.get_batch_size() == 1
     print(f"\n[harness] Running submission for {test} inference")
 
     # Ensure the required directories exist
     utils.ensure_directories(params.rootdir)
 
     # Build the submission if not built already
-    utils.build_submission(params.rootdir/"scripts")
+    tracing.name_process(os.getpid(), "harness")
+    if not args.skip_build:
+        with tracing.span("Build submission", "setup"):
+            utils.build_submission(params.rootdir/"scripts", params.cachedir()/"manifests")
 
     # The harness scripts are in the 'harness' directory,
     # the executables are in the directory submission/build
     harness_dir = params.rootdir/"harness"
     exec_dir = params.rootdir/"submission"/"build"
+    # With --batch_size, all the steps work on the batch-<n> instance
+    batch_args = ["--batch_size", custom_batch_size] if custom_batch_size is not None else []
+    # The server is given its threads explicitly rather than through the environment
+    server_args = ["--threads", args.server_threads]
+    utils.set_server_threads(args.server_threads)
 
-    # Remove and re-create IO directory
+    # Remove and re-create IO directory. Unlike the other setup stages, this
+    # one is never skipped: the artifacts of a previous invocation could make
+    # a failed step go unnoticed, e.g. stale predictions pass verification
     io_dir = params.iodir()
-    if io_dir.exists():
-        subprocess.run(["rm", "-rf", str(io_dir)], check=True)
-    io_dir.mkdir(parents=True)
-    utils.log_step(0, "Init", True)
+    with tracing.span("Reset IO directory", "setup"):
+        if io_dir.exists():
+            subprocess.run(["rm", "-rf", str(io_dir)], check=True)
+        io_dir.mkdir(parents=True)
+    trace_path = params.measuredir() / "trace.json"
+
+    # The steps are run as soon as the artifacts they need are produced:
+    # the harness steps overlap with the client and server steps, which are
+    # timed one at a time (see dag.py)
 
-    # 1. Client-side: Generate the test datasets
+    # 1. Client-side: Generate the test datasets, unless they were generated
+    # from the same raw MNIST test set by the same code already
     dataset_path = params.datadir() / f"dataset.txt"
-    cmd = ["python3", harness_dir/"generate_dataset.py", str(dataset_path)]
-    subprocess.run(cmd, check=True)
-    utils.log_step(1, "Harness: MNIST Test dataset generation")
+    raw_dir = harness_dir/"mnist"/"data"/"MNIST"/"raw"
+    dataset_manifest = cache.StageManifest(
+        params.cachedir()/"manifests"/f"dataset-{test}.json",
+        inputs=lambda: {
+            "sources": cache.tree_digest(*(harness_dir/source for source in DATASET_SOURCES)),
+            "raw_test_set": cache.tree_digest(raw_dir/sampler.TEST_IMAGES_FILE, raw_dir/sampler.TEST_LABELS_FILE),
+        },
+        outputs=generate_dataset.dataset_files(dataset_path))
+    def generate_test_dataset():
+        def generate():
+            with utils.timed_step(1, "Harness: MNIST Test dataset generation"):
+                utils.run_harness_step([harness_dir/"generate_dataset.py", dataset_path],
+                                       generate_dataset.generate_dataset, dataset_path, isolated=isolated)
+        utils.run_setup_stage("Harness: MNIST Test dataset", dataset_manifest, generate)
 
     # 2. Client-side: Generate the cryptographic keys 
     # Note: this does not use the rng seed above, it lets the implementation
     #   handle its own prg needs. It means that even if called with the same
     #   seed multiple times, the keys and ciphertexts will still be different.
-    subprocess.run([exec_dir/"client_key_generation", str(size)], check=True)
-    utils.log_step(2 , "Client: Key Generation")
-    # Report size of keys and encrypted data
-    utils.log_size(io_dir / "public_keys", "Client: Public and evaluation keys")
+    # With --key_cache, the keys are reused across invocations, keyed by the
+    # fingerprint of the parameters that determine them
+    keys_cache = cache.DirectoryCache(params.cachedir()/"keys")
+    key_dirs = {"public_keys": io_dir/"public_keys", "secret_key": io_dir/"secret_key"}
+    def generate_keys():
+        keys_key = None
+        if key_cache:
+            with tracing.span("Look up cached keys", "overhead"):
+                key_params = subprocess.run([exec_dir/"client_key_generation", str(size), "--params"],
+                                            check=True, capture_output=True).stdout
+                keys_key = cache.bytes_digest(key_params)
+                cached = keys_cache.entry(keys_key).is_dir()
+            utils.log_cache("Client: Public and evaluation keys", cached, keys_key)
+        if keys_key is not None and cached:
+            print(f"         [harness] Reusing the keys cached under {keys_key}")
+            with utils.timed_step(2, "Client: Reuse cached keys"):
+                keys_cache.get(keys_key, key_dirs)
+        else:
+            with utils.timed_step(2, "Client: Key Generation"):
+                utils.run_command([exec_dir/"client_key_generation", size, *batch_args])
+            if keys_key is not None:
+                with tracing.span("Store keys", "overhead"):
+                    keys_cache.put(keys_key, key_dirs)
+        # Report size of keys and encrypted data
+        utils.log_size(io_dir / "public_keys", "Client: Public and evaluation keys")
 
     # 3. Server-side: Preprocess the (encrypted) dataset using exec_dir/server_preprocess_model
-    subprocess.run(exec_dir/"server_preprocess_model", check=True)
-    utils.log_step(3, "Server: (Encrypted) model preprocessing")
+    def preprocess_model():
+        with utils.timed_step(3, "Server: (Encrypted) model preprocessing"):
+            utils.run_command([exec_dir/"server_preprocess_model"])
+
+    # 3.1 Server-side: With --server_daemon, start the resident server, which loads
+    # the crypto context and keys once for all the runs
+    daemon = None
+    if server_daemon:
+        daemon = ServerDaemon([exec_dir/"server_encrypted_compute", size, *batch_args, *server_args])
+        # Also stop the server if the harness fails
+        atexit.register(daemon.stop)
+    def warm_up_server():
+        with utils.timed_step(3.1, "Server: Warm-up of the resident server"):
+            daemon.start()
+
+    # 3.2 Harness: For batch inference, train the harness plaintext model once
+    # before the runs, so that their 10.1 steps never train it concurrently
+    def train_harness_model():
+        with tracing.span("Train harness plaintext model", "overhead"):
+            cleartext_impl.ensure_model()
+
+    setup_steps = [
+        dag.Step("1", generate_test_dataset, outputs=["dataset"]),
+        dag.Step("2", generate_keys, outputs=["keys"], exclusive=True),
+        dag.Step("3", preprocess_model, inputs=["keys"], outputs=["model"], exclusive=True),
+    ]
+    if server_daemon:
+        setup_steps.append(dag.Step("3.1", warm_up_server, inputs=["keys", "model"], outputs=["server"],
+                                    exclusive=True))
+    if not single:
+        setup_steps.append(dag.Step("3.2", train_harness_model, outputs=["harness model"]))
+    setup_artifacts = [output for step in setup_steps for output in step.outputs]
+    dag.run_steps(setup_steps)
 
-    # Run steps 4-10 multiple times if requested
-    for run in range(num_runs):
-        run_path = params.measuredir() / f"results-{run+1}.json"
-        if num_runs > 1:
-            print(f"\n         [harness] Run {run+1} of {num_runs}")
+    # Harness model predictions, keyed by the digest of the input pixels and model weights
+    preds_cache = cache.LRUFileCache(params.cachedir()/"cleartext", max_bytes=CLEARTEXT_CACHE_BYTES)
 
-        # 4. Client-side: Generate a new random input using harness/generate_input.py
-        cmd = ["python3", harness_dir/"generate_input.py", str(size)]
+    # Warm-up runs have negative numbers. In pipelined mode, each run has its
+    # own io and dataset sub-directories, so that consecutive runs can overlap
+    runs = list(range(-num_warmup, num_runs))
+    def run_label(run):
+        return f"Warm-up run {run+num_warmup+1}" if run < 0 else f"Run {run+1}"
+    def run_tag(run):
+        return f"warmup-{run+num_warmup+1}" if run < 0 else f"run-{run+1}"
+    run_params = {run: InstanceParams(size, run=run_tag(run) if pipeline else None,
+                                      batch_size=custom_batch_size)
+                  for run in runs}
+    # Each run reports the setup steps above and its own steps 4-10 only
+    run_measurements = {run: utils.snapshot_measurements() for run in runs}
+    run_begin, run_end = {}, {}
+
+    def run_args(run):
+        return [*batch_args, *(["--run", run_params[run].run] if pipeline else [])]
+
+    def run_step(action, run):
+        """ Return a step action recording into the measurements of run """
+        def record():
+            with utils.recording_run(run_measurements[run]):
+                action(run)
+        return record
+
+    # 4. Client-side: Generate a new random input using harness/generate_input.py
+    def generate_run_input(run):
+        run_begin[run] = tracing.now_ns()
+        if run < 0:
+            print(f"\n         [harness] {run_label(run)} of {num_warmup}")
+        elif num_runs > 1:
+            print(f"\n         [harness] {run_label(run)} of {num_runs}")
+        cmd = [harness_dir/"generate_input.py", size, "--pixels_format", pixels_format, *run_args(run)]
+        genqry_seed = None
         if seed is not None:
             # Use a different seed for each run but derived from the base seed
             rng = np.random.default_rng(seed)
-            genqry_seed = rng.integers(0,0x7fffffff)
-            cmd.extend(["--seed", str(genqry_seed)])
-        subprocess.run(cmd, check=True)
-        utils.log_step(4, "Harness: Input generation for MNIST")
-
-        # 5. Client-side: Preprocess input using exec_dir/client_preprocess_input
-        subprocess.run([exec_dir/"client_preprocess_input", str(size)], check=True)
-        utils.log_step(5, "Client: Input preprocessing")
-
-        # 6. Client-side: Encrypt the input
-        subprocess.run([exec_dir/"client_encode_encrypt_input", str(size)], check=True)
-        utils.log_step(6, "Client: Input encryption")
-        utils.log_size(io_dir / "ciphertexts_upload", "Client: Encrypted input")
-
-        # 7. Server side: Run the encrypted processing run exec_dir/server_encrypted_compute
-        subprocess.run([exec_dir/"server_encrypted_compute", str(size)], check=True)
-        utils.log_step(7, "Server: Encrypted ML Inference computation")
+            genqry_seed = int(rng.integers(0,0x7fffffff))
+            cmd.extend(["--seed", genqry_seed])
+        with utils.timed_step(4, "Harness: Input generation for MNIST"):
+            utils.run_harness_step(cmd, generate_input.generate_input, run_params[run], genqry_seed,
+                                   pixels_format, isolated=isolated)
+
+    # 5. Client-side: Preprocess input using exec_dir/client_preprocess_input
+    def preprocess_input(run):
+        with utils.timed_step(5, "Client: Input preprocessing"):
+            utils.run_command([exec_dir/"client_preprocess_input", size, *run_args(run)])
+
+    # Steps 6-8 may split the batch into shards run by several processes (see --workers)
+    batch_size = params.get_batch_size()
+
+    # 6. Client-side: Encrypt the input
+    def encrypt_input(run):
+        with utils.timed_step(6, "Client: Input encryption"):
+            utils.run_sharded_command([exec_dir/"client_encode_encrypt_input", size, *run_args(run)],
+                                      batch_size, workers)
+        utils.log_size(run_params[run].run_iodir() / "ciphertexts_upload", "Client: Encrypted input",
+                       num_samples=batch_size)
+
+    # 7. Server side: Run the encrypted processing run exec_dir/server_encrypted_compute
+    def encrypted_compute(run):
+        with utils.timed_step(7, "Server: Encrypted ML Inference computation"):
+            if daemon is not None:
+                # Only the request and its response are timed, the keys are already loaded
+                with utils.process_resources(daemon.proc.pid):
+                    daemon.compute(run_params[run].run, 0, batch_size)
+            else:
+                utils.run_sharded_command([exec_dir/"server_encrypted_compute", size, *run_args(run),
+                                           *server_args], batch_size, workers)
         # Report size of encrypted results
-        utils.log_size(io_dir / "ciphertexts_download", "Client: Encrypted results")
+        utils.log_size(run_params[run].run_iodir() / "ciphertexts_download", "Client: Encrypted results",
+                       num_samples=batch_size)
+
+    # 8. Client-side: decrypt
+    def decrypt_results(run):
+        prms = run_params[run]
+        with utils.timed_step(8, "Client: Result decryption"):
+            shards = utils.run_sharded_command([exec_dir/"client_decrypt_decode", size, *run_args(run)],
+                                               batch_size, workers)
+            if len(shards) > 1:
+                # Merge the predictions of the shards in order
+                with open(prms.get_encrypted_model_predictions_file(), "wb") as preds:
+                    for begin, end in shards:
+                        shard_preds = prms.get_encrypted_model_predictions_shard_file(begin, end)
+                        with open(shard_preds, "rb") as f:
+                            shutil.copyfileobj(f, preds)
+                        shard_preds.unlink()
+
+    # 6-8. With --stream, the client encrypts the inputs, the server computes on
+    # them and the client decrypts the results concurrently: each sample moves
+    # on to the next step as soon as its ciphertext is written, and the client
+    # stays at most stream_depth samples ahead of the server
+    def stream_batch(run):
+        prms = run_params[run]
+        for ctxt_dir in ("ciphertexts_upload", "ciphertexts_download"):
+            # The steps must only pick up the ciphertexts of this run
+            shutil.rmtree(prms.run_iodir() / ctxt_dir, ignore_errors=True)
+        first_prediction = []
+        def on_line(line):
+            if line.strip() == utils.FIRST_PREDICTION_LINE and not first_prediction:
+                first_prediction.append(tracing.now_ns())
+
+        procs = []
+        def stage(action):
+            def run_stage():
+                try:
+                    action()
+                except BaseException:
+                    # The other steps would wait forever for this one. The
+                    # resident server cannot be killed, so it is told to
+                    # give up its request with the abort markers
+                    for ctxt_dir in ("ciphertexts_upload", "ciphertexts_download"):
+                        (prms.run_iodir() / ctxt_dir).mkdir(parents=True, exist_ok=True)
+                        (prms.run_iodir() / ctxt_dir / utils.STREAM_ABORT_FILE).touch()
+                    for proc in procs:
+                        proc.kill()
+                    raise
+            return run_stage
+        def compute():
+            if daemon is not None:
+                with utils.process_resources(daemon.proc.pid):
+                    daemon.compute(prms.run, 0, batch_size, stream=True)
+            else:
+                utils.run_command([exec_dir/"server_encrypted_compute", size, *run_args(run), *server_args,
+                                   "--stream"],
+                                  procs=procs)
+        stages = {
+            "Client: Input encryption": lambda: utils.run_command(
+                [exec_dir/"client_encode_encrypt_input", size, *run_args(run), "--stream", stream_depth],
+                procs=procs),
+            "Server: Encrypted ML Inference computation": compute,
+            "Client: Result decryption": lambda: utils.run_command(
+                [exec_dir/"client_decrypt_decode", size, *run_args(run), "--stream"],
+                on_line=on_line, procs=procs),
+        }
+        with utils.timed_step("6-8", "Client and server: Streamed encryption, computation and decryption"):
+            begin = tracing.now_ns()
+            elapsed = utils.run_concurrently({name: stage(action) for name, action in stages.items()})
+            end = tracing.now_ns()
+        utils.log_streaming((end - begin) / 1e9, (first_prediction[0] - begin) / 1e9, stream_depth, elapsed)
+        utils.log_size(prms.run_iodir() / "ciphertexts_upload", "Client: Encrypted input",
+                       num_samples=batch_size)
+        utils.log_size(prms.run_iodir() / "ciphertexts_download", "Client: Encrypted results",
+                       num_samples=batch_size)
 
-        # 8. Client-side: decrypt
-        subprocess.run([exec_dir/"client_decrypt_decode", str(size)], check=True)
-        utils.log_step(8, "Client: Result decryption")
+    # 9. Client-side: post-process
+    def postprocess_results(run):
+        with utils.timed_step(9, "Client: Result postprocessing"):
+            utils.run_command([exec_dir/"client_postprocess", size, *run_args(run)])
 
-        # 9. Client-side: post-process
-        subprocess.run([exec_dir/"client_postprocess", str(size)], check=True)
-        utils.log_step(9, "Client: Result postprocessing")
+    # 10.1 Run the cleartext computation in cleartext_impl.py
+    # The predictions are reused across runs and invocations for the same
+    # input and model, unless --clrtxt 1 asks to recompute them
+    def run_cleartext(run):
+        prms = run_params[run]
+        test_pixels = utils.get_test_input_file(prms, pixels_format)
+        harness_model_preds = prms.get_harness_model_predictions_file()
+        harness_model_preds.parent.mkdir(parents=True, exist_ok=True)
+        model_path = params.rootdir/cleartext_impl.MODEL_PATH
+        with tracing.span("Look up harness model predictions", "overhead"):
+            preds_key = cache.file_digest(test_pixels, model_path)
+        # A hit is recorded with the cache lookups rather than as a step of its
+        # own, so that the step is a single series across runs and invocations.
+        # The entry may have been evicted since by another run or invocation,
+        # in which case the inference is run after all
+        with utils.timed_step(10.1, "Harness: Run inference for harness plaintext model"):
+            cached = clrtxt != 1 and preds_cache.get(preds_key, harness_model_preds)
+            if not cached:
+                utils.run_harness_step([harness_dir/"cleartext_impl.py", test_pixels, harness_model_preds],
+                                       cleartext_impl.run_cleartext, test_pixels, harness_model_preds,
+                                       isolated=isolated)
+        if not cached:
+            with tracing.span("Store harness model predictions", "overhead"):
+                preds_cache.put(preds_key, harness_model_preds)
+        utils.log_cache("Harness: Harness model predictions", cached, preds_key)
 
-        # 10 Verify the result for single inference or calculate quality for batch inference.
-        encrypted_model_preds = params.get_encrypted_model_predictions_file()
-        ground_truth_labels = params.get_ground_truth_labels_file()
+    # 10 Verify the result for single inference or calculate quality for batch inference.
+    def check_results(run):
+        prms = run_params[run]
+        encrypted_model_preds = prms.get_encrypted_model_predictions_file()
+        ground_truth_labels = prms.get_ground_truth_labels_file()
         if not encrypted_model_preds.exists():
             print(f"Error: Result file {encrypted_model_preds} not found")
             sys.exit(1)
 
-        if (size == utils.SINGLE):
-            subprocess.run(["python3", harness_dir/"verify_result.py",
-                str(ground_truth_labels), str(encrypted_model_preds)], check=False)
+        if single:
+            utils.run_harness_step([harness_dir/"verify_result.py", ground_truth_labels, encrypted_model_preds],
+                                   verify_result.verify_result, ground_truth_labels, encrypted_model_preds,
+                                   isolated=isolated, check=False)
         else:
-            # 10.1 Run the cleartext computation in cleartext_impl.py
-            test_pixels = params.get_test_input_file()
-            harness_model_preds = params.get_harness_model_predictions_file()
-            subprocess.run(["python3", harness_dir/"cleartext_impl.py", str(test_pixels), str(harness_model_preds)], check=True)
-            utils.log_step(10.1, "Harness: Run inference for harness plaintext model")
-
             # 10.2 Run the quality calculation
-            utils.calculate_quality(ground_truth_labels, encrypted_model_preds, "Encrypted model")
-            utils.calculate_quality(ground_truth_labels, harness_model_preds, "Harness model")
-            utils.log_step(10.2, "Harness: Run quality check")
+            harness_model_preds = prms.get_harness_model_predictions_file()
+            with utils.timed_step(10.2, "Harness: Run quality check"):
+                utils.calculate_quality(ground_truth_labels, encrypted_model_preds, "Encrypted model")
+                utils.calculate_quality(ground_truth_labels, harness_model_preds, "Harness model")
+
+    # 11. Store measurements and the timeline so far
+    def save_measurements(run):
+        run_end[run] = tracing.now_ns()
+        tracing.add_span(run_label(run), run_begin[run], run_end[run], cat="run")
+        if run >= 0:
+            run_path = params.measuredir() / f"results-{run+1}.json"
+            run_path.parent.mkdir(parents=True, exist_ok=True)
+            utils.save_run(run_path, utils.SINGLE if single else size)
+        tracing.save_trace(trace_path)
+        if pipeline:
+            # Only keep the ciphertexts of the runs in flight
+            for ctxt_dir in ("ciphertexts_upload", "ciphertexts_download"):
+                shutil.rmtree(run_params[run].run_iodir() / ctxt_dir, ignore_errors=True)
+
+    # Steps 4-11 of every run. The harness model only needs the input of the
+    # run, so 10.1 overlaps with steps 5-9.
+    # Sequentially, a run starts once the previous one is over. In pipelined
+    # mode, the client prepares the input of the next run while the server
+    # computes on the current one, and each run is decrypted and checked
+    # while the server moves on to the next one.
+    steps = []
+    for run in runs:
+        def artifact(name, run=run):
+            return f"{name} of {run_label(run)}"
+        first, prev = run == runs[0], run - 1
+        if not pipeline:
+            run_inputs = {4: [] if first else [artifact("measurements", prev)]}
+        else:
+            run_inputs = {
+                4: [] if first else [artifact("upload", prev)],
+                7: [] if first else [artifact("download", prev)],
+                8: [] if first else [artifact("measurements", prev)],
+            }
+            if run - 2 >= runs[0]:
+                # The client is at most one run ahead of the server
+                run_inputs[4].append(artifact("download", run - 2))
+        check_inputs = [artifact("results")]
+        if not single:
+            check_inputs.append(artifact("harness predictions"))
+        server_inputs = ["model", *(["server"] if server_daemon else [])]
+        if not stream:
+            encrypted_steps = [
+                dag.Step(artifact("6"), run_step(encrypt_input, run), exclusive=not pipeline,
+                         inputs=["keys", artifact("preprocessed input")], outputs=[artifact("upload")]),
+                dag.Step(artifact("7"), run_step(encrypted_compute, run), exclusive=not pipeline,
+                         inputs=[*server_inputs, artifact("upload"), *run_inputs.get(7, [])],
+                         outputs=[artifact("download")]),
+                dag.Step(artifact("8"), run_step(decrypt_results, run), exclusive=not pipeline,
+                         inputs=[artifact("download"), *run_inputs.get(8, [])],
+                         outputs=[artifact("decrypted results")]),
+            ]
+        else:
+            encrypted_steps = [
+                dag.Step(artifact("6-8"), run_step(stream_batch, run), exclusive=not pipeline,
+                         inputs=["keys", *server_inputs, artifact("preprocessed input"),
+                                 *run_inputs.get(7, []), *run_inputs.get(8, [])],
+                         outputs=[artifact("upload"), artifact("download"), artifact("decrypted results")]),
+            ]
+        steps += [
+            dag.Step(artifact("4"), run_step(generate_run_input, run),
+                     inputs=["dataset", *run_inputs.get(4, [])], outputs=[artifact("input")]),
+            dag.Step(artifact("5"), run_step(preprocess_input, run), exclusive=not pipeline,
+                     inputs=[artifact("input")], outputs=[artifact("preprocessed input")]),
+            *encrypted_steps,
+            dag.Step(artifact("9"), run_step(postprocess_results, run), exclusive=not pipeline,
+                     inputs=[artifact("decrypted results")], outputs=[artifact("results")]),
+            dag.Step(artifact("10"), run_step(check_results, run),
+                     inputs=check_inputs, outputs=[artifact("quality")]),
+            dag.Step(artifact("11"), run_step(save_measurements, run),
+                     inputs=[artifact("quality")], outputs=[artifact("measurements")]),
+        ]
+        if not single:
+            # One run at a time, as the runs share the predictions cache
+            steps.append(dag.Step(artifact("10.1"), run_step(run_cleartext, run),
+                                  inputs=["harness model", artifact("input"),
+                                          *([] if first else [artifact("harness predictions", prev)])],
+                                  outputs=[artifact("harness predictions")]))
+    dag.run_steps(steps, available=setup_artifacts)
 
-        # 11. Store measurements
-        run_path.parent.mkdir(parents=True, exist_ok=True)
-        utils.save_run(run_path, size)
+    # Statistics over the measured runs, and their sustained throughput
+    wall_seconds = (run_end[num_runs-1] - run_begin[0]) / 1e9
+    throughput = utils.throughput(num_runs * params.get_batch_size(), wall_seconds,
+                                  "pipelined" if pipeline else "sequential")
+    utils.save_summary(params.measuredir() / "summary.json", num_warmup, throughput)
+    if daemon is not None:
+        daemon.stop()
 
-    print(f"\nAll steps completed for the {instance_name(size)} inference!")
+    print(f"\nAll steps completed for the {test} inference!")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+server_daemon.py - Thin client of the resident server, which loads the crypto
+context and keys once and then serves inference requests on a Unix socket
+(see serve in submission/src/server_encrypted_compute.cpp).
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import tracing
+
+class ServerDaemon:
+    """ A server_encrypted_compute process started with --daemon, and a connection to it """
+
+    # Loading the keys can take minutes for the real parameters
+    READY_TIMEOUT_S = 3600
+    POLL_INTERVAL_S = 0.05
+
+    def __init__(self, cmd: list):
+        self.socket_path = Path(tempfile.gettempdir()) / f"fhe-server-{os.getpid()}.sock"
+        self.cmd = [str(c) for c in cmd] + ["--daemon", str(self.socket_path)]
+        self.proc = None
+        self.conn = None
+        self.responses = None
+        self._reader = None
+
+    def start(self):
+        """ Start the server and wait until it has loaded the keys and accepts requests """
+        self.socket_path.unlink(missing_ok=True)
+        self.proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, text=True, bufsize=1)
+        tracing.name_process(self.proc.pid, Path(self.cmd[0]).name + " (daemon)")
+        self._reader = threading.Thread(target=self._forward_output, daemon=True)
+        self._reader.start()
+
+        deadline = time.monotonic() + self.READY_TIMEOUT_S
+        while True:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"The server exited with code {self.proc.returncode} before being ready")
+            try:
+                self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.conn.connect(str(self.socket_path))
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                self.conn.close()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"The server is not ready after {self.READY_TIMEOUT_S}s")
+                time.sleep(self.POLL_INTERVAL_S)
+        self.responses = self.conn.makefile("r")
+
+    def _forward_output(self):
+        """ Forward the output of the server, and add its trace lines to the timeline """
+        for line in self.proc.stdout:
+            if not tracing.parse_trace_line(line, self.proc.pid):
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+    def request(self, request: str) -> str:
+        """ Send a request and return the response, raising an error if it failed """
+        self.conn.sendall((request + "\n").encode())
+        response = self.responses.readline().rstrip("\n")
+        if response != "ok":
+            raise RuntimeError(f"The server failed to serve '{request}': {response or 'no response'}")
+        return response
+
+    def compute(self, run: str, begin: int, end: int, stream: bool = False):
+        """
+        Run the inference on the ciphertexts [begin, end) of the run (None for
+        the default one). When streaming, the server waits for each ciphertext
+        while the client encrypts them.
+        """
+        self.request(f"compute {run or '-'} {begin} {end}" + (" stream" if stream else ""))
+
+    def stop(self):
+        """ Shut the server down, or kill it if it does not stop. Does nothing if it is not running. """
+        if self.proc is None:
+            return
+        try:
+            if self.conn is not None and self.proc.poll() is None:
+                self.request("shutdown")
+            self.proc.wait(timeout=60)
+        except (OSError, RuntimeError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+            self._reader.join()
+            self.socket_path.unlink(missing_ok=True)
+            self.proc = None
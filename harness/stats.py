@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+stats.py - Summary statistics of repeated latency measurements.
+"""
+
+import math
+
+import numpy as np
+
+# Confidence level and number of resamples of the bootstrap intervals
+CONFIDENCE = 0.95
+NUM_RESAMPLES = 10000
+# Runs further than this many interquartile ranges outside the quartiles are outliers
+OUTLIER_IQR_FACTOR = 1.5
+# Largest product of the sample sizes for which the exact Mann-Whitney distribution is computed
+MANN_WHITNEY_EXACT_MAX = 2500
+
+def bootstrap_ci(samples, confidence: float = CONFIDENCE, num_resamples: int = NUM_RESAMPLES,
+                 seed: int = 0):
+    """
+    Percentile bootstrap confidence interval of the mean of samples.
+    The resampling is seeded so that the same samples give the same interval.
+    """
+    samples = np.asarray(samples, dtype=float)
+    if len(samples) < 2:
+        return float(samples.mean()), float(samples.mean())
+    rng = np.random.default_rng(seed)
+    means = rng.choice(samples, size=(num_resamples, len(samples)), replace=True).mean(axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+def outliers(samples, factor: float = OUTLIER_IQR_FACTOR):
+    """ Return the indices of the samples outside Tukey's fences """
+    samples = np.asarray(samples, dtype=float)
+    if len(samples) < 4:
+        return []
+    q1, q3 = np.quantile(samples, [0.25, 0.75])
+    low, high = q1 - factor * (q3 - q1), q3 + factor * (q3 - q1)
+    return [int(i) for i in np.flatnonzero((samples < low) | (samples > high))]
+
+def summarize(samples, confidence: float = CONFIDENCE):
+    """
+    Return the mean, median, sample standard deviation, extrema, tail
+    percentiles and bootstrap confidence interval of the mean of samples.
+    """
+    samples = np.asarray(samples, dtype=float)
+    ci_low, ci_high = bootstrap_ci(samples, confidence)
+    return {
+        "count": len(samples),
+        "mean": float(samples.mean()),
+        "median": float(np.median(samples)),
+        "stddev": float(samples.std(ddof=1)) if len(samples) > 1 else 0.0,
+        "min": float(samples.min()),
+        "max": float(samples.max()),
+        "p90": float(np.percentile(samples, 90)),
+        "p99": float(np.percentile(samples, 99)),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+    }
+
+def _rank(values):
+    """ Ranks of values from 1, ties getting the mean of their ranks """
+    order = np.argsort(values, kind="mergesort")
+    ranks = np.empty(len(values))
+    sorted_values = values[order]
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and sorted_values[j + 1] == sorted_values[i]:
+            j += 1
+        ranks[order[i:j + 1]] = (i + j) / 2 + 1
+        i = j + 1
+    return ranks
+
+def _mann_whitney_counts(n1: int, n2: int):
+    """
+    Number of orderings of n1 + n2 distinct values for which the U statistic
+    of the first sample, the number of pairs in which it is the larger one,
+    is u, indexed by u. Built by removing the largest value: from the first
+    sample, it is larger than all the values of the second one.
+    """
+    previous = [np.ones(1)] * (n2 + 1)
+    for i in range(1, n1 + 1):
+        current = [np.ones(1)]
+        for j in range(1, n2 + 1):
+            first = np.concatenate([np.zeros(j), previous[j]])
+            second = current[j - 1]
+            counts = np.zeros(max(len(first), len(second)))
+            counts[:len(first)] += first
+            counts[:len(second)] += second
+            current.append(counts)
+        previous = current
+    return previous[n2]
+
+def mann_whitney_u(samples1, samples2):
+    """
+    Two-sided Mann-Whitney U test of whether the values of samples1 tend to
+    be larger or smaller than those of samples2. Returns the U statistic of
+    samples1 and the p-value, exact for small samples without ties and
+    otherwise from the normal approximation with tie correction.
+    """
+    samples1 = np.asarray(samples1, dtype=float)
+    samples2 = np.asarray(samples2, dtype=float)
+    n1, n2 = len(samples1), len(samples2)
+    if n1 == 0 or n2 == 0:
+        raise ValueError("Both samples must be non-empty")
+    values = np.concatenate([samples1, samples2])
+    ranks = _rank(values)
+    u = float(ranks[:n1].sum() - n1 * (n1 + 1) / 2)
+    _, tie_sizes = np.unique(values, return_counts=True)
+    has_ties = np.any(tie_sizes > 1)
+
+    if not has_ties and n1 * n2 <= MANN_WHITNEY_EXACT_MAX:
+        counts = _mann_whitney_counts(n1, n2)
+        cdf = np.cumsum(counts) / counts.sum()
+        k = int(round(u))
+        lower = cdf[k]
+        upper = 1 - (cdf[k - 1] if k > 0 else 0)
+        return u, float(min(1.0, 2 * min(lower, upper)))
+
+    n = n1 + n2
+    mean = n1 * n2 / 2
+    tie_term = np.sum(tie_sizes ** 3 - tie_sizes) / (n * (n - 1)) if n > 1 else 0
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term)
+    if variance <= 0:
+        # All the values are equal
+        return u, 1.0
+    z = (abs(u - mean) - 0.5) / math.sqrt(variance)
+    return u, float(min(1.0, math.erfc(max(z, 0) / math.sqrt(2))))
+
+def min_p_value(n1: int, n2: int) -> float:
+    """ Smallest p-value the two-sided Mann-Whitney test can reach with samples of n1 and n2 values """
+    return min(1.0, 2 / math.comb(n1 + n2, n1))
+
+def bootstrap_relative_change_ci(baseline, candidate, confidence: float = CONFIDENCE,
+                                 num_resamples: int = NUM_RESAMPLES, seed: int = 0):
+    """
+    Percentile bootstrap confidence interval of the relative change of the
+    median from baseline to candidate, median(candidate) / median(baseline) - 1,
+    resampling both independently. The resampling is seeded.
+    """
+    baseline = np.asarray(baseline, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    rng = np.random.default_rng(seed)
+    baseline_medians = np.median(rng.choice(baseline, size=(num_resamples, len(baseline))), axis=1)
+    candidate_medians = np.median(rng.choice(candidate, size=(num_resamples, len(candidate))), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = candidate_medians / baseline_medians - 1
+    changes = changes[np.isfinite(changes)]
+    if len(changes) == 0:
+        return float("nan"), float("nan")
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(changes, [alpha, 1 - alpha])
+    return float(low), float(high)
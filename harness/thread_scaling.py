@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+thread_scaling.py - Measure how the FHE stages scale with the number of OpenMP threads.
+
+Runs the whole submission (run_submission.py) with OMP_NUM_THREADS set to
+each of the given thread counts, and reports the median latency, speedup
+and parallel efficiency of key generation, encryption, encrypted
+computation and decryption at each of them. The speedups are relative to
+the smallest thread count t0: speedup(t) = latency(t0) / latency(t), and
+efficiency(t) = speedup(t) * t0 / t.
+The measurements of each thread count (results-N.json, summary.json and
+trace.json) are kept in threads-<n>/ under the measurements of the instance,
+next to the report: thread_scaling.csv (one row per stage and thread count)
+and thread_scaling.json.
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+from params import InstanceParams, SINGLE, LARGE
+import utils
+
+# Stages whose scaling is reported, with --stream the streamed steps 6-8
+FHE_STAGES = [
+    "Client: Key Generation",
+    "Client: Input encryption",
+    "Server: Encrypted ML Inference computation",
+    "Client: Result decryption",
+    "Client and server: Streamed encryption, computation and decryption",
+]
+# Name of the series of the total latency in the report
+TOTAL = "Total latency"
+
+def default_thread_counts() -> list:
+    """ 1, 2, 4, ... up to the number of available CPUs, which is always included """
+    num_cpus = utils.available_cpus()
+    counts = []
+    t = 1
+    while t < num_cpus:
+        counts.append(t)
+        t *= 2
+    return counts + [num_cpus]
+
+def parse_thread_counts(text: str) -> list:
+    """ Parse a comma-separated list of thread counts, e.g. 1,2,4,8 """
+    try:
+        counts = sorted({int(t) for t in text.split(",") if t.strip()})
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid thread counts: {text}")
+    if not counts or counts[0] < 1:
+        raise argparse.ArgumentTypeError("the thread counts must be positive")
+    return counts
+
+def keep_measurements(measure_dir: Path, point_dir: Path) -> dict:
+    """
+    Copy the measurements of the invocation that just ran, which the next
+    one overwrites, from measure_dir to point_dir. Return its summary.
+    """
+    with open(measure_dir / "summary.json") as f:
+        summary = json.load(f)
+    shutil.rmtree(point_dir, ignore_errors=True)
+    point_dir.mkdir(parents=True)
+    # Earlier invocations with more runs may have left results-N.json files behind
+    files = [f"results-{run}.json" for run in range(1, summary["num_runs"] + 1)]
+    for name in ["summary.json", "trace.json", *files]:
+        if (measure_dir / name).exists():
+            shutil.copy2(measure_dir / name, point_dir / name)
+    return summary
+
+def scaling_report(summaries: dict) -> dict:
+    """
+    Collect the median latency of the FHE stages, and the total latency,
+    from the summary.json of each thread count, and compute their speedup
+    and efficiency. Stages that were not measured (e.g. with --key_cache)
+    are left out.
+    """
+    base_threads = min(summaries)
+    stages = {}
+    for threads, summary in summaries.items():
+        series = {TOTAL: summary["total_latency_s"],
+                  **{stage: summary["per_stage_s"][stage] for stage in FHE_STAGES
+                     if stage in summary["per_stage_s"]}}
+        for stage, stats in series.items():
+            stages.setdefault(stage, {})[threads] = stats["median"]
+
+    report = {}
+    for stage, medians in stages.items():
+        if base_threads not in medians:
+            continue
+        base = medians[base_threads]
+        report[stage] = [{
+            "threads": threads,
+            "median_s": median,
+            "speedup": round(base / median, 4),
+            "efficiency": round(base / median * base_threads / threads, 4),
+        } for threads, median in sorted(medians.items())]
+    return {
+        "thread_counts": sorted(summaries),
+        "base_threads": base_threads,
+        "statistic": "median",
+        # The thread counts of each run are in its results files
+        "host": {key: value for key, value in utils.host_info().items()
+                 if key in ("cpu_model", "num_cpus", "available_cpus")},
+        "stages": report,
+    }
+
+def main():
+    """
+    Usage:  python3 thread_scaling.py  <size>  [--threads 1,2,4,...]  [--batch_size N]
+                                           [run_submission.py options]
+    """
+    parser = argparse.ArgumentParser(
+        description='Measure the scaling of the FHE stages with the number of OpenMP threads. '
+                    'The other options are passed on to run_submission.py.')
+    parser.add_argument('size', type=int, choices=range(SINGLE, LARGE+1),
+                        help='Instance size (0-single/1-small/2-medium/3-large)')
+    parser.add_argument('--threads', type=parse_thread_counts, default=default_thread_counts(),
+                        help='Comma-separated OMP_NUM_THREADS values to run '
+                             '(default: powers of two up to the number of available CPUs)')
+    parser.add_argument('--batch_size', type=int,
+                        help='Custom number of samples in the batch (see run_submission.py)')
+    args, submission_options = parser.parse_known_args()
+    if args.batch_size is not None:
+        submission_options += ["--batch_size", str(args.batch_size)]
+
+    harness_dir = Path(__file__).resolve().parent
+    params = InstanceParams(args.size, batch_size=args.batch_size)
+    summaries = {}
+    for threads in args.threads:
+        print(f"\n[scaling] OMP_NUM_THREADS={threads}")
+        subprocess.run([sys.executable, harness_dir/"run_submission.py", str(args.size), *submission_options],
+                       env={**os.environ, "OMP_NUM_THREADS": str(threads)}, check=True)
+        summaries[threads] = keep_measurements(params.measuredir(), params.measuredir() / f"threads-{threads}")
+
+    report = scaling_report(summaries)
+    with open(params.measuredir() / "thread_scaling.json", "w") as f:
+        json.dump(report, f, indent=2)
+    with open(params.measuredir() / "thread_scaling.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stage", "threads", "median_s", "speedup", "efficiency"])
+        for stage, points in report["stages"].items():
+            for point in points:
+                writer.writerow([stage, point["threads"], point["median_s"],
+                                 point["speedup"], point["efficiency"]])
+
+    print(f"\n[scaling] {'Stage':<45} {'threads':>7} {'median':>10} {'speedup':>8} {'efficiency':>10}")
+    for stage, points in report["stages"].items():
+        for point in points:
+            print(f"[scaling] {stage:<45.45} {point['threads']:>7} {point['median_s']:>9.4f}s",
+                  f"{point['speedup']:>8.2f} {point['efficiency']:>10.2f}")
+    print(f"[scaling] Report written to {params.measuredir()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+tracing.py - Timeline of the harness in Chrome trace-event format.
+
+Stages, sub-stages and runs are recorded as complete ("X") events with
+monotonic begin/end timestamps. The submission binaries report their
+internal phases as lines on stdout (see TracePhase in submission/include/utils.h):
+    [trace] <begin_ns> <end_ns> <phase name>
+taken from the same monotonic clock, so that they line up with the harness
+stages. The workers of a thread pool report theirs as [trace:<n>] lines,
+which go to a track of their own. The resulting trace.json can be opened in https://ui.perfetto.dev
+or chrome://tracing.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+TRACE_LINE = re.compile(r"\[trace(?::(\d+))?\] (\d+) (\d+) (.*)")
+
+# Recorded trace events
+_events = []
+_lock = threading.Lock()
+# Tracks of the worker threads of the child processes named so far
+_worker_tracks = set()
+
+def now_ns() -> int:
+    """ Monotonic clock in nanoseconds, the same one as std::chrono::steady_clock on Linux """
+    return time.perf_counter_ns()
+
+def add_event(event: dict):
+    with _lock:
+        _events.append(event)
+
+def add_span(name: str, begin_ns: int, end_ns: int, cat: str = "harness",
+             pid: int = None, tid: int = None, args: dict = None):
+    """ Record a complete event from begin_ns to end_ns """
+    event = {
+        "name": name,
+        "cat": cat,
+        "ph": "X",
+        "ts": begin_ns / 1000,
+        "dur": (end_ns - begin_ns) / 1000,
+        "pid": pid if pid is not None else os.getpid(),
+        "tid": tid if tid is not None else threading.get_native_id(),
+    }
+    if args:
+        event["args"] = args
+    add_event(event)
+
+@contextmanager
+def span(name: str, cat: str = "harness", **args):
+    """ Record the execution of the enclosed block """
+    begin = now_ns()
+    try:
+        yield
+    finally:
+        add_span(name, begin, now_ns(), cat, args=args)
+
+def name_process(pid: int, name: str):
+    """ Label the track of a (child) process in the timeline """
+    add_event({"name": "process_name", "ph": "M", "pid": pid, "tid": pid,
+               "args": {"name": name}})
+
+def parse_trace_line(line: str, pid: int) -> bool:
+    """
+    Record the phase reported by a trace line of process pid.
+    Returns False if the line is not a trace line.
+    """
+    match = TRACE_LINE.fullmatch(line.rstrip("\n"))
+    if match is None:
+        return False
+    thread, begin_ns, end_ns, name = match.groups()
+    tid = pid
+    if thread is not None and int(thread) > 0:
+        # Track of worker n of the process, numbered after its main thread
+        tid = pid * 1000 + int(thread)
+        with _lock:
+            new_track = tid not in _worker_tracks
+            _worker_tracks.add(tid)
+        if new_track:
+            add_event({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": f"worker {thread}"}})
+    add_span(name, int(begin_ns), int(end_ns), cat="phase", pid=pid, tid=tid)
+    return True
+
+def save_trace(path: Path):
+    """ Write the events recorded so far to path """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        events = list(_events)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
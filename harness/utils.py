@@ -6,46 +6,181 @@ utils.py - Scaffolding code for running the submission.
 import sys
 import subprocess
 import argparse
+import copy
 import json
+import os
+import platform
+import threading
+import cache
+import stats
+import tracing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from params import InstanceParams, SINGLE, LARGE
-from typing import Tuple
+from params import InstanceParams, SINGLE, LARGE, MAX_BATCH_SIZE
+from typing import Callable, Dict, Tuple
+from mnist.dataset_io import PIXELS_FORMATS
+
+# Line printed by client_decrypt_decode --stream once its first prediction is
+# written (see FIRST_PREDICTION_LINE in submission/include/utils.h)
+FIRST_PREDICTION_LINE = "[stream] first prediction"
+
+# Marker file which aborts the stages of a streamed batch waiting for a
+# ciphertext in its directory (see STREAM_ABORT_FILE in submission/include/utils.h)
+STREAM_ABORT_FILE = "abort"
 
-# Global variable to track the last timestamp
-_last_timestamp: datetime = None
 # Global variable to store measured times
 _timestamps = {}
 _timestampsStr = {}
 # Global variable to store measured sizes
 _bandwidth = {}
+_bandwidth_bytes = {}
+# Sizes are broken down per file for directories with at most this many files
+MAX_SIZE_BREAKDOWN_FILES = 16
 # Global variable to store model quality metrics
 _model_quality = {}
+# Global variable to store the resources used by the child processes of each step
+_resources = {}
+_resources_lock = threading.Lock()
+# Global variable to store the timings of the shards of the sharded steps
+_shards = {}
+# Global variable to store the outcome of the cache lookups that replace steps
+_caches = {}
+# Global variable to store the latencies of the streamed steps 6-8 (see --stream)
+_streaming = {}
+# Name of the step being timed by the current thread
+_current_step = threading.local()
+# Step latencies of the measured runs saved so far, for the summary
+_runs = []
+# Identifier of this invocation in its results files, which also record the
+# setup stages it ran once for all its runs (see save_run)
+_invocation = f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+# Measurements of the pipelined run whose steps the current thread is executing
+_run_store = threading.local()
+# Number of ciphertexts the server computes on concurrently (see set_server_threads)
+_server_threads = None
 
-def parse_submission_arguments(workload: str) -> Tuple[int, InstanceParams, int, int, int, bool]:
+def _measurements() -> dict:
+    """
+    Return the measurements to record into: those of the run set with
+    recording_run for the current thread, or the global ones.
+    """
+    store = getattr(_run_store, "measurements", None)
+    if store is not None:
+        return store
+    return {
+        "timestamps": _timestamps,
+        "timestampsStr": _timestampsStr,
+        "bandwidth": _bandwidth,
+        "bandwidth_bytes": _bandwidth_bytes,
+        "model_quality": _model_quality,
+        "resources": _resources,
+        "shards": _shards,
+        "caches": _caches,
+        "streaming": _streaming,
+    }
+
+@contextmanager
+def recording_run(measurements: dict):
+    """
+    Record the steps run by the current thread in the enclosed block into
+    measurements (see snapshot_measurements) rather than the global ones,
+    so that concurrent runs do not mix their measurements.
+    """
+    _run_store.measurements = measurements
+    try:
+        yield
+    finally:
+        _run_store.measurements = None
+
+def parse_submission_arguments(workload: str) -> Tuple[int, InstanceParams, int, int, int]:
     """
     Get the arguments of the submission. Populate arguments as needed for the workload.
     """
-    # Parse arguments using argparse
+    args = parse_submission_options(workload)
+    size = args.size
+    seed = args.seed
+    num_runs = args.num_runs
+    clrtxt = args.clrtxt
+
+    # Use params.py to get instance parameters
+    params = InstanceParams(size, batch_size=args.batch_size)
+    return size, params, seed, num_runs, clrtxt
+
+def parse_submission_options(workload: str, run_option: bool = False) -> argparse.Namespace:
+    """
+    Parse all the command-line options of the submission, including those
+    that are not returned by parse_submission_arguments. The --run option
+    is only accepted by the steps that run_submission.py calls per run.
+    """
     parser = argparse.ArgumentParser(description=workload)
     parser.add_argument('size', type=int, choices=range(SINGLE, LARGE+1),
                         help='Instance size (0-single/1-small/2-medium/3-large)')
+    parser.add_argument('--batch_size', type=int,
+                        help='Custom number of samples in the batch, instead of that of the instance size; '
+                             'the instance then has its own batch-<n> directories')
     parser.add_argument('--num_runs', type=int, default=1,
                         help='Number of times to run steps 4-9 (default: 1)')
+    parser.add_argument('--warmup', type=int, default=0,
+                        help='Number of unrecorded runs of steps 4-9 before the measured ones (default: 0)')
     parser.add_argument('--seed', type=int,
                         help='Random seed for dataset and query generation')
     parser.add_argument('--clrtxt', type=int,
                         help='Specify with 1 if to rerun the cleartext computation')
-
+    parser.add_argument('--pixels_format', choices=PIXELS_FORMATS, default='bin',
+                        help='Format of the test pixels file (default: bin)')
+    parser.add_argument('--subprocess', action='store_true',
+                        help='Run the Python harness steps in fresh python3 processes instead of in-process')
+    parser.add_argument('--key_cache', action='store_true',
+                        help='Reuse the keys generated with the same parameters by a previous '
+                             'invocation (not for official measurements)')
+    parser.add_argument('--server_daemon', action='store_true',
+                        help='Load the server keys once in a resident server that serves step 7 of '
+                             'every run, and time its warm-up as a separate step')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes sharing the batch in steps 6-8, or only 6 and 8 '
+                             'with --server_daemon (default: 1)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Overlap the client steps 4-6 of each run with the server step 7 of the '
+                             'previous one, in per-run io sub-directories, to measure throughput')
+    parser.add_argument('--stream', action='store_true',
+                        help='Run steps 6-8 of each run concurrently, each sample going through '
+                             'them as soon as it is ready, and record the time to the first prediction')
+    parser.add_argument('--stream_depth', type=int, default=4,
+                        help='Maximum number of samples encrypted ahead of the server with --stream '
+                             '(default: 4)')
+    parser.add_argument('--server_threads', type=int,
+                        help='Number of ciphertexts the server computes on concurrently, which share '
+                             'the OpenMP threads (default: $SERVER_THREADS or 1)')
+    parser.add_argument('--skip_build', action='store_true',
+                        help='Do not build the submission, which must be built already (e.g. when '
+                             'several instances run concurrently, see run_matrix.py)')
+    if run_option:
+        parser.add_argument('--run',
+                            help='Tag of the per-run io and dataset sub-directories (see --pipeline)')
     args = parser.parse_args()
-    size = args.size
-    seed = args.seed
-    num_runs = args.num_runs
-    clrtxt = args.clrtxt
+    if args.num_runs < 1:
+        parser.error('--num_runs must be at least 1')
+    if args.warmup < 0:
+        parser.error('--warmup cannot be negative')
+    if args.server_threads is None:
+        args.server_threads = int(os.environ.get("SERVER_THREADS", "1"))
+    if args.server_threads < 1:
+        parser.error('--server_threads must be at least 1')
+    if args.stream and args.workers > 1:
+        parser.error('--stream runs a single process per step, it cannot be combined with --workers')
+    if args.batch_size is not None and not 1 <= args.batch_size <= MAX_BATCH_SIZE:
+        parser.error(f'--batch_size must be between 1 and {MAX_BATCH_SIZE}, the size of the MNIST test set')
+    if args.stream_depth < 1:
+        parser.error('--stream_depth must be at least 1')
+    return args
 
-    # Use params.py to get instance parameters
-    params = InstanceParams(size)
-    return size, params, seed, num_runs, clrtxt
+def get_test_input_file(params: InstanceParams, pixels_format: str) -> Path:
+    """ Return the test pixels file path for the given pixels format """
+    if pixels_format == 'txt':
+        return params.get_test_input_file()
+    return params.get_test_input_bin_file()
 
 def ensure_directories(rootdir: Path):
     """ Check that the current directory has sub-directories
@@ -57,58 +192,383 @@ def ensure_directories(rootdir: Path):
                   f"not found in {rootdir}")
             sys.exit(1)
 
-def build_submission(script_dir: Path):
+def build_submission(script_dir: Path, manifest_dir: Path):
     """
-    Build the submission, including pulling dependencies as neeed
+    Build the submission, including pulling dependencies as neeed. Each of
+    the two stages is skipped while its manifest in manifest_dir shows that
+    its inputs are unchanged and its outputs in place (see run_setup_stage).
     """
+    rootdir = script_dir.parent
+    openfhe_dir = rootdir/"third_party"/"openfhe"
+    submission_dir = rootdir/"submission"
     # Clone and build OpenFHE if needed
-    subprocess.run([script_dir/"get_openfhe.sh"], check=True)
-    # CMake build of the submission itself
-    subprocess.run([script_dir/"build_task.sh", "./submission"], check=True)
+    openfhe = cache.StageManifest(
+        manifest_dir/"openfhe.json",
+        inputs=lambda: {"get_openfhe.sh": cache.file_digest(script_dir/"get_openfhe.sh")},
+        outputs=[openfhe_dir])
+    run_setup_stage("Setup: OpenFHE", openfhe,
+                    lambda: subprocess.run([script_dir/"get_openfhe.sh"], check=True))
+    # CMake build of the submission itself, against the installed OpenFHE
+    build = cache.StageManifest(
+        manifest_dir/"build.json",
+        inputs=lambda: {
+            "build_task.sh": cache.file_digest(script_dir/"build_task.sh"),
+            "submission": cache.tree_digest(submission_dir, exclude=("build",)),
+            "openfhe": cache.bytes_digest(json.dumps(cache.tree_state(openfhe_dir)).encode()),
+        },
+        outputs=[submission_dir/"build"])
+    run_setup_stage("Setup: Submission build", build,
+                    lambda: subprocess.run([script_dir/"build_task.sh", "./submission"], check=True))
+
+def run_setup_stage(object_name: str, manifest: cache.StageManifest, action: Callable[[], None]) -> bool:
+    """
+    Run action, the setup stage producing object_name, unless its manifest
+    shows that it is up to date, and record whether it was skipped as a
+    cache hit under the fingerprint of its inputs. Return True if skipped.
+    """
+    with tracing.span(f"Look up {object_name}", "overhead"):
+        hit, fingerprint = manifest.lookup()
+    if hit:
+        print(f"         [harness] {object_name} is up to date, skipping it")
+    else:
+        action()
+        fingerprint = manifest.record()
+    log_cache(object_name, hit, fingerprint)
+    return hit
+
+def run_harness_step(cmd: list, entry_point: Callable, *args, isolated: bool = False, check: bool = True):
+    """
+    Run one of the Python harness steps, either by calling its entry point
+    with args in this interpreter, or with cmd in a fresh python3 process.
+    """
+    if isolated:
+        run_command(["python3", *cmd], check=check)
+    else:
+        entry_point(*args)
+
+def run_command(cmd: list, check: bool = True, on_line: Callable[[str], None] = None,
+                procs: list = None) -> int:
+    """
+    Run one of the submission binaries. Its output is forwarded to stdout,
+    except for the trace lines reporting its internal phases, which are
+    added to the timeline. The other lines are also passed to on_line, if
+    given, as soon as they are printed. The process is appended to procs,
+    if given, so that the caller can kill it.
+    """
+    cmd = [str(c) for c in cmd]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, bufsize=1)
+    if procs is not None:
+        procs.append(proc)
+    monitor = ResourceMonitor(proc)
+    tracing.name_process(proc.pid, Path(cmd[0]).name)
+    begin = tracing.now_ns()
+    for line in proc.stdout:
+        if not tracing.parse_trace_line(line, proc.pid):
+            if on_line is not None:
+                on_line(line)
+            sys.stdout.write(line)
+            sys.stdout.flush()
+    returncode, usage = monitor.wait()
+    tracing.add_span(Path(cmd[0]).name, begin, tracing.now_ns(), cat="process",
+                     pid=proc.pid, tid=proc.pid, args={"cmd": " ".join(cmd), **usage})
+    step_name = getattr(_current_step, "name", None)
+    if step_name is not None:
+        log_resources(step_name, usage)
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return returncode
+
+def read_peak_rss(pid="self") -> int:
+    """ VmHWM of process pid in bytes, or None if it is not available (e.g. once the process exited) """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+class ResourceMonitor:
+    """
+    Collects the resource usage of a child process: the rusage figures from
+    wait4 and, on Linux, the I/O counters of /proc/<pid>/io, read before the
+    child is reaped. The peak memory is sampled from VmHWM in /proc/<pid>/status
+    while the child runs, because ru_maxrss also covers the harness memory
+    the child inherited before exec. The exited child has no VmHWM any more,
+    so the growth after the last sample is taken from ru_maxrss, when it
+    exceeds what the child can have inherited: the peak of the harness.
+    """
+
+    SAMPLE_INTERVAL_S = 0.02
+
+    def __init__(self, proc: subprocess.Popen):
+        self.proc = proc
+        self.peak_rss_bytes = 0
+        self.inherited_rss_bytes = read_peak_rss() or 0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_peak_rss, daemon=True)
+        self._sampler.start()
+
+    def _sample_peak_rss(self):
+        while True:
+            hwm = read_peak_rss(self.proc.pid)
+            if hwm is None:
+                return
+            self.peak_rss_bytes = max(self.peak_rss_bytes, hwm)
+            if self._stop.wait(self.SAMPLE_INTERVAL_S):
+                return
+
+    def wait(self) -> Tuple[int, dict]:
+        """ Wait for the child to exit and return its exit code and resource usage """
+        proc = self.proc
+        io_counters = {}
+        if hasattr(os, "waitid"):
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            self._stop.set()
+            try:
+                with open(f"/proc/{proc.pid}/io") as f:
+                    counters = dict(line.split(":") for line in f)
+                for counter in ("rchar", "wchar", "read_bytes", "write_bytes"):
+                    io_counters[counter] = int(counters[counter])
+            except (OSError, KeyError, ValueError):
+                pass
+        __, status, rusage = os.wait4(proc.pid, 0)
+        self._stop.set()
+        self._sampler.join()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+        # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+        ru_maxrss_bytes = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        max_rss_bytes = self.peak_rss_bytes
+        if max_rss_bytes == 0:
+            # No /proc
+            max_rss_bytes = ru_maxrss_bytes
+        elif ru_maxrss_bytes > self.inherited_rss_bytes:
+            # Beyond the inherited memory, ru_maxrss is the peak of the child
+            # after exec, including its growth after the last sample
+            max_rss_bytes = max(max_rss_bytes, ru_maxrss_bytes)
+        usage = {
+            "max_rss_bytes": max_rss_bytes,
+            "user_cpu_s": round(rusage.ru_utime, 6),
+            "sys_cpu_s": round(rusage.ru_stime, 6),
+            "voluntary_ctx_switches": rusage.ru_nvcsw,
+            "involuntary_ctx_switches": rusage.ru_nivcsw,
+            **io_counters,
+        }
+        return proc.returncode, usage
+
+def process_usage(pid: int) -> dict:
+    """
+    Resource usage of the running process pid so far, from /proc, in the
+    terms of ResourceMonitor. Returns None where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The fields after the parenthesized command name, from the state (3rd) on
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        ticks_per_s = os.sysconf("SC_CLK_TCK")
+        usage = {
+            "max_rss_bytes": int(status["VmHWM"].split()[0]) * 1024,
+            "user_cpu_s": int(fields[11]) / ticks_per_s,
+            "sys_cpu_s": int(fields[12]) / ticks_per_s,
+            "voluntary_ctx_switches": int(status["voluntary_ctxt_switches"]),
+            "involuntary_ctx_switches": int(status["nonvoluntary_ctxt_switches"]),
+        }
+    except (OSError, KeyError, IndexError, ValueError):
+        return None
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            counters = dict(line.split(":") for line in f)
+        for counter in ("rchar", "wchar", "read_bytes", "write_bytes"):
+            usage[counter] = int(counters[counter])
+    except (OSError, KeyError, ValueError):
+        pass
+    return usage
+
+@contextmanager
+def process_resources(pid: int):
+    """
+    Add the resources used by the running process pid during the enclosed
+    block to the current step, e.g. for the resident server, which serves a
+    step without being started for it: the differences of its CPU times,
+    context switches and I/O counters, and its peak memory since it started.
+    """
+    before = process_usage(pid)
+    yield
+    after = process_usage(pid)
+    step_name = getattr(_current_step, "name", None)
+    if before is None or after is None or step_name is None:
+        return
+    usage = {key: value if key == "max_rss_bytes" else value - before.get(key, 0)
+             for key, value in after.items()}
+    usage["user_cpu_s"] = round(usage["user_cpu_s"], 6)
+    usage["sys_cpu_s"] = round(usage["sys_cpu_s"], 6)
+    log_resources(step_name, usage)
+
+def log_resources(step_name: str, usage: dict):
+    """
+    Add the resource usage of a child process to its step. Steps that run
+    several processes report the peak of their memory and the sum of the rest.
+    """
+    with _resources_lock:
+        step = _measurements()["resources"].setdefault(step_name, {})
+        for key, value in usage.items():
+            if key == "max_rss_bytes":
+                step[key] = max(step.get(key, 0), value)
+            else:
+                step[key] = step.get(key, 0) + value
+
+def shard_ranges(batch_size: int, num_shards: int) -> list:
+    """ Split [0, batch_size) into at most num_shards contiguous ranges of similar sizes """
+    num_shards = max(1, min(num_shards, batch_size))
+    bounds = [batch_size * i // num_shards for i in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def run_sharded_command(cmd: list, batch_size: int, workers: int) -> list:
+    """
+    Run one of the submission binaries on shards of the batch, given with
+    its --begin and --end options, in up to workers concurrent processes.
+    The timings of the shards are recorded for the current step.
+    Returns the shard ranges.
+    """
+    ranges = shard_ranges(batch_size, workers)
+    if len(ranges) == 1:
+        run_command(cmd)
+        return ranges
+
+    # The worker threads record into the step and run of the caller
+    step_name = getattr(_current_step, "name", None)
+    measurements = _measurements()
+    def run_shard(shard):
+        _current_step.name = step_name
+        _run_store.measurements = measurements
+        begin = tracing.now_ns()
+        run_command([*cmd, "--begin", shard[0], "--end", shard[1]])
+        elapsed_seconds = (tracing.now_ns() - begin) / 1e9
+        print(f"         [harness] {step_name} shard [{shard[0]}, {shard[1]}) completed",
+              f"(elapsed: {round(elapsed_seconds, 4)}s)")
+        return {"begin": shard[0], "end": shard[1], "elapsed_s": round(elapsed_seconds, 6)}
 
-def log_step(step_num: int, step_name: str, start: bool = False):
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        shards = list(pool.map(run_shard, ranges))
+    if step_name is not None:
+        measurements["shards"][step_name] = shards
+    return ranges
+
+def run_concurrently(actions: Dict[str, Callable[[], None]]) -> Dict[str, float]:
+    """
+    Run the actions in concurrent threads, which record into the step and
+    run of the caller. Returns the time from the start until the end of
+    each action, in seconds. The first exception raised by an action is
+    re-raised once they are all over.
+    """
+    step_name = getattr(_current_step, "name", None)
+    measurements = _measurements()
+    begin = tracing.now_ns()
+    def run_action(action):
+        _current_step.name = step_name
+        _run_store.measurements = measurements
+        action()
+        return round((tracing.now_ns() - begin) / 1e9, 6)
+
+    with ThreadPoolExecutor(max_workers=len(actions)) as pool:
+        futures = {name: pool.submit(run_action, action) for name, action in actions.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+@contextmanager
+def timed_step(step_num, step_name: str):
+    """
+    Time the enclosed harness step from its start to its end, so that the
+    harness work done between steps is not counted, and add it to the timeline.
+    """
+    begin = tracing.now_ns()
+    resources = _measurements()["resources"]
+    resources.pop(step_name, None)
+    _current_step.name = step_name
+    try:
+        yield
+    finally:
+        _current_step.name = None
+    end = tracing.now_ns()
+    tracing.add_span(f"{step_num}: {step_name}", begin, end, cat="stage")
+    log_step(step_num, step_name, (end - begin) / 1e9)
+    if step_name in resources:
+        # Share of the step spent on CPU by its child processes, which may
+        # exceed 1 for multi-threaded processes
+        step = resources[step_name]
+        step["wall_s"] = (end - begin) / 1e9
+        step["cpu_utilization"] = round((step["user_cpu_s"] + step["sys_cpu_s"]) / step["wall_s"], 4)
+        print(f"         [harness] {step_name} peak memory: {human_readable_size(step['max_rss_bytes'])},",
+              f"CPU utilization: {step['cpu_utilization']}")
+
+def log_step(step_num, step_name: str, elapsed_seconds: float):
     """ 
     Helper function to print timestamp after each step with second precision 
     """
-    global _last_timestamp
-    global _timestamps
-    global _timestampsStr
-    now = datetime.now()
-    # Format with milliseconds precision
-    timestamp = now.strftime("%H:%M:%S")
-
-    # Calculate elapsed time if this isn't the first call
-    elapsed_str = ""
-    elapsed_seconds = 0
-    if _last_timestamp is not None:
-        elapsed_seconds = (now - _last_timestamp).total_seconds()
-        elapsed_str = f" (elapsed: {round(elapsed_seconds, 4)}s)"
-
-    # Update the last timestamp for the next call
-    _last_timestamp = now
-
-    if (not start):
-        print(f"{timestamp} [harness] {step_num}: {step_name} completed{elapsed_str}")
-        _timestampsStr[step_name] = f"{round(elapsed_seconds, 4)}s"
-        _timestamps[step_name] = elapsed_seconds
-
-def log_size(path: Path, object_name: str, flag: bool = False, previous: int = 0):
-    global _bandwidth
+    measurements = _measurements()
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    elapsed_str = f" (elapsed: {round(elapsed_seconds, 4)}s)"
+
+    print(f"{timestamp} [harness] {step_num}: {step_name} completed{elapsed_str}")
+    measurements["timestampsStr"][step_name] = f"{round(elapsed_seconds, 4)}s"
+    measurements["timestamps"][step_name] = elapsed_seconds
+
+def file_sizes(path: Path) -> Dict[str, int]:
+    """
+    Return the exact size in bytes of every file under path, keyed by
+    their path relative to path.
+    """
+    sizes = {}
+    pending = [(path, "")]
+    while pending:
+        directory, prefix = pending.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append((entry.path, f"{prefix}{entry.name}/"))
+                elif entry.is_file(follow_symlinks=False):
+                    sizes[prefix + entry.name] = entry.stat(follow_symlinks=False).st_size
+    return sizes
+
+def log_size(path: Path, object_name: str, flag: bool = False, previous: int = 0,
+             num_samples: int = None):
+    """
+    Log the total size of the files under path, and store it with a
+    per-file breakdown (or per-file statistics for many files) in bytes.
+    """
+    measurements = _measurements()
     
     # Check if the path exists before trying to calculate size
     if not path.exists():
         print(f"         [harness] Warning: {object_name} path does not exist: {path}")
-        _bandwidth[object_name] = "0B"
+        measurements["bandwidth"][object_name] = "0B"
+        measurements["bandwidth_bytes"][object_name] = {"total_bytes": 0, "num_files": 0}
         return 0
     
-    size = int(subprocess.run(["du", "-sb", path], check=True,
-                           capture_output=True, text=True).stdout.split()[0])
+    with tracing.span(f"Measure {object_name} size", "overhead"):
+        sizes = file_sizes(path)
+    size = sum(sizes.values())
     if(flag):
         size -= previous
     
     print("         [harness]", object_name, "size:", human_readable_size(size))
 
-    _bandwidth[object_name] = human_readable_size(size)
+    measurements["bandwidth"][object_name] = human_readable_size(size)
+    breakdown = {"total_bytes": size, "num_files": len(sizes)}
+    if sizes:
+        breakdown.update({
+            "min_file_bytes": min(sizes.values()),
+            "mean_file_bytes": round(sum(sizes.values()) / len(sizes)),
+            "max_file_bytes": max(sizes.values()),
+        })
+    if num_samples:
+        breakdown["bytes_per_sample"] = round(size / num_samples)
+    if len(sizes) <= MAX_SIZE_BREAKDOWN_FILES:
+        breakdown["files"] = dict(sorted(sizes.items()))
+    measurements["bandwidth_bytes"][object_name] = breakdown
     return size
 
 def human_readable_size(n: int):
@@ -118,27 +578,146 @@ def human_readable_size(n: int):
         n /= 1024
     return f"{n:.1f}P"
 
+def available_cpus() -> int:
+    """ Number of CPUs this process may run on """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+def cpu_affinity() -> list:
+    """ The CPUs this process may run on, or None where the OS does not tell """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return None
+
+def set_server_threads(server_threads: int):
+    """ Record the --threads the server is run with, for host_info """
+    global _server_threads
+    _server_threads = server_threads
+
+def host_info() -> dict:
+    """
+    The CPU model, the CPUs and the thread counts the submission runs with, so
+    that results from different machines can be compared. Without
+    OMP_NUM_THREADS, OpenMP runs as many threads as there are available CPUs.
+    """
+    cpu_model = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    omp_num_threads = os.environ.get("OMP_NUM_THREADS", "")
+    # The first level of a nested setting such as "4,2"
+    omp_threads = omp_num_threads.split(",")[0].strip()
+    return {
+        "cpu_model": cpu_model,
+        "num_cpus": os.cpu_count(),
+        "available_cpus": available_cpus(),
+        "cpu_affinity": cpu_affinity(),
+        "omp_num_threads": int(omp_threads) if omp_threads.isdigit() else available_cpus(),
+        "omp_num_threads_set": bool(omp_num_threads),
+        "server_threads": _server_threads if _server_threads is not None
+                          else int(os.environ.get("SERVER_THREADS", "1")),
+    }
+
+def snapshot_measurements() -> dict:
+    """ Return a copy of the measurements recorded so far """
+    return copy.deepcopy(_measurements())
+
 def save_run(path: Path, size: int = 0):
-    global _timestamps
-    global _timestampsStr
-    global _bandwidth
-    global _model_quality
+    measurements = _measurements()
+    timestamps = measurements["timestamps"]
+
+    # Only the sharded steps (see --workers) report their shards, only the
+    # steps that may be served from a cache their lookups, and only the
+    # streamed runs (see --stream) their streaming latencies
+    optional = {key: measurements[key] for key in ("shards", "caches", "streaming")
+                if measurements[key]}
+    # The stages recorded outside of a run (see recording_run) are the setup
+    # stages, measured once for all the runs of the invocation
+    per_invocation_stages = [step_name for step_name in measurements["timestampsStr"]
+                             if measurements["timestampsStr"] is not _timestampsStr
+                             and step_name in _timestampsStr]
+    invocation = {"invocation": _invocation, "per_invocation_stages": per_invocation_stages}
 
     if size == 0:
         json.dump({
-            "total_latency_ms": round(sum(_timestamps.values()), 4),
-            "per_stage": _timestampsStr,
-            "bandwidth": _bandwidth,
+            "total_latency_ms": round(sum(timestamps.values()), 4),
+            "per_stage": measurements["timestampsStr"],
+            "bandwidth": measurements["bandwidth"],
+            "bandwidth_bytes": measurements["bandwidth_bytes"],
+            "resources": measurements["resources"],
+            "host": host_info(),
+            **invocation,
+            **optional,
         }, open(path,"w"), indent=2)
     else:
         json.dump({
-            "total_latency_ms": round(sum(_timestamps.values()), 4),
-            "per_stage": _timestampsStr,
-            "bandwidth": _bandwidth,
-            "mnist_model_quality" : _model_quality,
+            "total_latency_ms": round(sum(timestamps.values()), 4),
+            "per_stage": measurements["timestampsStr"],
+            "bandwidth": measurements["bandwidth"],
+            "bandwidth_bytes": measurements["bandwidth_bytes"],
+            "mnist_model_quality" : measurements["model_quality"],
+            "resources": measurements["resources"],
+            "host": host_info(),
+            **invocation,
+            **optional,
         }, open(path,"w"), indent=2)
 
-    print("[total latency]", f"{round(sum(_timestamps.values()), 4)}s")
+    _runs.append(dict(timestamps))
+    print("[total latency]", f"{round(sum(timestamps.values()), 4)}s")
+
+def save_summary(path: Path, num_warmup: int = 0, throughput: dict = None):
+    """
+    Write the statistics of the total and per-stage latencies, in seconds,
+    over the runs saved with save_run. Outlier runs are numbered from 1.
+    The sustained throughput of the runs, if given, is reported separately.
+    """
+    def summarize(samples):
+        summary = {key: round(value, 6) if isinstance(value, float) else value
+                   for key, value in stats.summarize(samples).items()}
+        return {**summary,
+                "outlier_runs": [i+1 for i in stats.outliers(samples)]}
+
+    stages = {}
+    for run in _runs:
+        for step_name in run:
+            stages.setdefault(step_name, None)
+    summary = {
+        "num_runs": len(_runs),
+        "num_warmup_runs": num_warmup,
+        "confidence": stats.CONFIDENCE,
+        "total_latency_s": summarize([sum(run.values()) for run in _runs]),
+        # Stages that were skipped in some runs are summarized over the others
+        "per_stage_s": {step_name: summarize([run[step_name] for run in _runs if step_name in run])
+                        for step_name in stages},
+    }
+    if throughput is not None:
+        summary["throughput"] = throughput
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    total = summary["total_latency_s"]
+    print(f"[summary] total latency over {len(_runs)} runs:",
+          f"mean {total['mean']:.4f}s, median {total['median']:.4f}s, stddev {total['stddev']:.4f}s,",
+          f"{round(100*stats.CONFIDENCE)}% CI [{total['ci_low']:.4f}s, {total['ci_high']:.4f}s]")
+    if total["outlier_runs"]:
+        print(f"[summary] outlier runs: {total['outlier_runs']}")
+    if throughput is not None:
+        print(f"[summary] {throughput['mode']} throughput: {throughput['inferences_per_hour']:.1f} inferences/hour")
+
+def throughput(num_inferences: int, wall_seconds: float, mode: str) -> dict:
+    """ Sustained throughput of num_inferences done in wall_seconds """
+    return {
+        "mode": mode,
+        "inferences": num_inferences,
+        "wall_s": round(wall_seconds, 6),
+        "inferences_per_hour": round(num_inferences * 3600 / wall_seconds, 3),
+    }
 
 def calculate_quality(label_file: Path, pred_file: Path, tag: str):
     """
@@ -146,11 +725,6 @@ def calculate_quality(label_file: Path, pred_file: Path, tag: str):
     Label file and predictions file should contain one label per line.
     Logs accuracy metric and prints results.
     """
-    __, params, __, __, __ = parse_submission_arguments('Generate query for FHE benchmark.')
-
-    label_file = params.get_ground_truth_labels_file()
-    pred_file = params.get_encrypted_model_predictions_file()
-
     try:
         # Read expected labels (one per line)
         labels = label_file.read_text().strip().split('\n')
@@ -172,9 +746,28 @@ def calculate_quality(label_file: Path, pred_file: Path, tag: str):
     log_quality(correct_pred, num_samples, f"{tag} quality")
 
 
+def log_streaming(batch_latency_s: float, first_prediction_s: float, stream_depth: int,
+                  stage_elapsed_s: Dict[str, float]):
+    """
+    Record the latencies of streamed steps 6-8: of the whole batch, until the
+    first prediction is written, and until the end of each step, from their
+    common start.
+    """
+    print(f"         [harness] Time to first prediction: {round(first_prediction_s, 4)}s,",
+          f"batch latency: {round(batch_latency_s, 4)}s")
+    _measurements()["streaming"].update({
+        "stream_depth": stream_depth,
+        "time_to_first_prediction_s": round(first_prediction_s, 6),
+        "batch_latency_s": round(batch_latency_s, 6),
+        "stage_elapsed_s": stage_elapsed_s,
+    })
+
+def log_cache(object_name: str, hit: bool, key: str):
+    """ Record whether object_name was served from a cache, and under which key """
+    _measurements()["caches"][object_name] = {"hit": hit, "key": key}
+
 def log_quality(correct_predictions, total_samples, tag):
-    global _model_quality
-    _model_quality[tag] = {
+    _measurements()["model_quality"][tag] = {
         "correct_predictions": correct_predictions,
         "total_samples": total_samples,
         "accuracy": correct_predictions / total_samples if total_samples > 0 else 0
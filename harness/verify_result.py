@@ -6,33 +6,37 @@ verify_result.py - correctness oracle for ML Inference workload.
 import sys
 from pathlib import Path
 
-def main():
-
+def verify_result(expected_file: Path, result_file: Path) -> bool:
     """
-    Usage:  python3 verify_result.py  <expected_file>  <result_file>
-    Returns exit-code 0 if equal, 1 otherwise.
-    Prints a message so the caller can log it.
+    Compare the expected and obtained labels.
+    Prints a message so the caller can log it and returns True if equal.
     """
-
-    if len(sys.argv) != 3:
-        sys.exit("Usage: verify_result.py <expected> <result>")
-
-    expected_file = Path(sys.argv[1])
-    result_file   = Path(sys.argv[2])
-
     try:
         exp = int(expected_file.read_text().strip())
         res = int(result_file.read_text().strip())
     except Exception as e:
         print(f"[harness] failed to read files: {e}")
-        sys.exit(1)
+        return False
 
     if res == exp:
         print(f"[harness] PASS  (expected={exp}, got={res})")
-        sys.exit(0)
+        return True
     else:
         print(f"[harness] FAIL  (expected={exp}, got={res})")
-        sys.exit(1)
+        return False
+
+def main():
+
+    """
+    Usage:  python3 verify_result.py  <expected_file>  <result_file>
+    Returns exit-code 0 if equal, 1 otherwise.
+    Prints a message so the caller can log it.
+    """
+
+    if len(sys.argv) != 3:
+        sys.exit("Usage: verify_result.py <expected> <result>")
+
+    sys.exit(0 if verify_result(Path(sys.argv[1]), Path(sys.argv[2])) else 1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -16,6 +16,10 @@ using PublicKeyT = PublicKey<DCRTPoly>;
 #define MNIST_DIM 784
 #define NORMALIZED_DIM 1024
 
+// Header of the binary pixels file, see harness/mnist/dataset_io.py
+#define PIXELS_MAGIC "FHEP"
+#define PIXELS_VERSION 1
+
 struct Sample {
   float image[NORMALIZED_DIM];
 };
@@ -27,6 +31,7 @@ PrivateKey<DCRTPoly> read_secret_key(const InstanceParams& prms);
 CryptoContext<DCRTPoly> read_crypto_context(const InstanceParams& prms);
 void read_eval_keys(const InstanceParams& prms, CryptoContextT cc);
 void load_dataset(std::vector<Sample> &dataset, const char *filename);
+fs::path dataset_file(const InstanceParams& prms);
 int argmax(float *A, int N);
 
 #endif  // ifndef MLP_ENCRYPTION_UTILS_H_
\ No newline at end of file
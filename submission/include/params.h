@@ -29,40 +29,63 @@ class InstanceParams {
     size_t batchSize;
     // Add any parameters necessary
     fs::path rootdir; // root of the submission dir structure (see below)
+    std::string run;  // tag of the run, whose inputs and outputs have their own
+                      // sub-directories (the keys are shared by all runs)
+    bool customBatch; // the batch size is not that of the instance size
 
 public:
-    // Constructor
+    // Constructor. A non-zero _batchSize replaces the batch size of the
+    // instance size, and its instance has its own directories.
     explicit InstanceParams(InstanceSize _size,
-                            fs::path _rootdir = fs::current_path())
-                            : size(_size), rootdir(_rootdir)
+                            fs::path _rootdir = fs::current_path(),
+                            std::string _run = "",
+                            size_t _batchSize = 0)
+                            : size(_size), rootdir(_rootdir), run(_run),
+                              customBatch(_batchSize != 0)
     {
         if (unsigned(_size) > unsigned(InstanceSize::LARGE)) {
             throw std::invalid_argument("Invalid instance size");
         }
 
         const int batchSizes[] = {1, 15, 1000, 10000};
-        batchSize    = batchSizes[int(_size)];
+        batchSize    = customBatch ? _batchSize : batchSizes[int(_size)];
     }
 
     // Getters for all the parameters. There are no setters, once
     // an object is constructed these parameters cannot be modified.
     const InstanceSize getSize() const { return size; }
     const size_t getBatchSize() const { return batchSize; }
+    const std::string& getRun() const { return run; }
+    // Name of the instance directories
+    std::string name() const {
+        return customBatch ? "batch-" + std::to_string(batchSize) : instance_name(size);
+    }
 
     // The relevant directories where things are found
     fs::path rtdir() const  { return rootdir; }
-    fs::path iodir() const  { return rootdir/"io"/instance_name(size); }
+    fs::path iodir() const  { return rootdir/"io"/name(); }
+    fs::path runiodir() const {
+        return run.empty() ? iodir() : iodir()/"runs"/run;
+    }
     fs::path pubkeydir() const { return iodir() / "public_keys"; }
     fs::path seckeydir() const { return iodir() / "secret_key"; }
-    fs::path ctxtupdir() const { return iodir() / "ciphertexts_upload"; }
-    fs::path ctxtdowndir() const { return iodir() / "ciphertexts_download"; }
-    fs::path iointermdir() const { return iodir() / "intermediate"; }
+    fs::path ctxtupdir() const { return runiodir() / "ciphertexts_upload"; }
+    fs::path ctxtdowndir() const { return runiodir() / "ciphertexts_download"; }
+    fs::path iointermdir() const { return runiodir() / "intermediate"; }
     fs::path datadir() const { 
-        return rootdir/"datasets"/instance_name(size);
+        return rootdir/"datasets"/name();
+    }
+    fs::path dataintermdir() const {
+        return run.empty() ? datadir()/"intermediate" : datadir()/"intermediate"/run;
     }
-    fs::path dataintermdir() const { return datadir() / "intermediate"; }
     fs::path test_input_file() const { return dataintermdir()/"test_pixels.txt"; }
-    fs::path encrypted_model_predictions_file() const { return iodir()/"encrypted_model_predictions.txt"; }
+    fs::path test_input_bin_file() const { return dataintermdir()/"test_pixels.bin"; }
+    fs::path encrypted_model_predictions_file() const { return runiodir()/"encrypted_model_predictions.txt"; }
+    // Predictions of the samples [begin, end) when the batch is split into shards
+    fs::path encrypted_model_predictions_file(size_t begin, size_t end) const {
+        return runiodir()/("encrypted_model_predictions_" + std::to_string(begin) + "-" +
+                           std::to_string(end) + ".txt");
+    }
 };
 
 #endif  // ifndef PARAMS_H_
\ No newline at end of file
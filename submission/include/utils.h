@@ -8,8 +8,149 @@
 #include "key/key-ser.h"
 #include "scheme/ckksrns/ckksrns-ser.h"
 
+#include <chrono>
+#include <filesystem>
+#include <iostream>
+#include <mutex>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <utility>
+
 using namespace lbcrypto;
 
-// Placeholder
+// Value of the command-line option name (e.g. "--run" for "--run TAG"),
+// or default_value if it is not given
+inline std::string get_option(int argc, char* argv[], const std::string& name,
+                              const std::string& default_value = "") {
+    for (int i = 1; i + 1 < argc; ++i) {
+        if (name == argv[i]) {
+            return argv[i + 1];
+        }
+    }
+    return default_value;
+}
+
+// Range [begin, end) of the batch processed by this process, given by the
+// --begin and --end options so that the harness can split the batch into
+// shards run by several processes; the whole batch by default
+inline std::pair<size_t, size_t> get_shard(int argc, char* argv[], size_t batch_size) {
+    size_t begin = std::stoul(get_option(argc, argv, "--begin", "0"));
+    size_t end = std::stoul(get_option(argc, argv, "--end", std::to_string(batch_size)));
+    if (begin > end || end > batch_size) {
+        throw std::invalid_argument("Invalid shard [" + std::to_string(begin) + ", " +
+                                    std::to_string(end) + ") of a batch of " +
+                                    std::to_string(batch_size));
+    }
+    return {begin, end};
+}
+
+// Whether the command-line flag name (e.g. "--stream") is given
+inline bool has_flag(int argc, char* argv[], const std::string& name) {
+    for (int i = 1; i < argc; ++i) {
+        if (name == argv[i]) {
+            return true;
+        }
+    }
+    return false;
+}
+
+// In streaming mode (--stream), the encryption, computation and decryption
+// of a batch run concurrently: each stage waits for the ciphertext files of
+// the previous one. A ciphertext file is complete once it exists, as it is
+// serialized under a temporary name and then renamed.
+template <typename T>
+void serialize_to_file_atomically(const std::filesystem::path& path, const T& obj) {
+    auto tmp_path = path;
+    tmp_path += ".tmp";
+    if (!Serial::SerializeToFile(tmp_path, obj, SerType::BINARY)) {
+        throw std::runtime_error("Failed to write " + tmp_path.string());
+    }
+    std::filesystem::rename(tmp_path, path);
+}
+
+// Marker file with which the harness aborts a streamed batch when one of its
+// stages fails, so that the others, e.g. the resident server, stop waiting
+#define STREAM_ABORT_FILE "abort"
+
+// Wait until the file at path exists, or throw once an abort marker exists
+// in the same directory, or after timeout_s seconds
+inline void wait_for_file(const std::filesystem::path& path, double timeout_s = 3600) {
+    auto deadline = std::chrono::steady_clock::now() + std::chrono::duration<double>(timeout_s);
+    auto abort_path = path.parent_path() / STREAM_ABORT_FILE;
+    while (!std::filesystem::exists(path)) {
+        if (std::filesystem::exists(abort_path)) {
+            throw std::runtime_error("Aborted while waiting for " + path.string());
+        }
+        if (std::chrono::steady_clock::now() > deadline) {
+            throw std::runtime_error("Timed out waiting for " + path.string());
+        }
+        std::this_thread::sleep_for(std::chrono::milliseconds(1));
+    }
+}
+
+// Line printed by the decryption once its first prediction is written, from
+// which the harness measures the time to the first prediction of a streamed batch
+#define FIRST_PREDICTION_LINE "[stream] first prediction"
+
+// Print a whole line on stdout, without interleaving it with the lines
+// printed by other threads
+inline void print_line(const std::string& line) {
+    static std::mutex stdout_mutex;
+    std::lock_guard<std::mutex> lock(stdout_mutex);
+    std::cout << line << '\n' << std::flush;
+}
+
+// Thread whose phases the calling thread reports: 0 for the main thread, and
+// the index of the worker for the other threads of a pool (see TracePhase)
+inline thread_local int trace_thread = 0;
+
+// Reports the time spent in a phase of the binary to the harness timeline
+// (see harness/tracing.py), as a line on stdout printed when the phase ends:
+//     [trace] <begin_ns> <end_ns> <name>
+// or, from worker n of a thread pool, which has its own track:
+//     [trace:<n>] <begin_ns> <end_ns> <name>
+// steady_clock is the monotonic clock also used by the harness.
+class TracePhase {
+public:
+    explicit TracePhase(std::string name)
+        : name_(std::move(name)), begin_(now_ns()), active_(true) {}
+    ~TracePhase() { end(); }
+    TracePhase(const TracePhase&) = delete;
+    TracePhase& operator=(const TracePhase&) = delete;
+
+    // End the current phase and start the next one
+    void next(std::string name) {
+        end();
+        name_ = std::move(name);
+        begin_ = now_ns();
+        active_ = true;
+    }
+
+    void end() {
+        if (!active_) {
+            return;
+        }
+        active_ = false;
+        std::ostringstream line;
+        line << "[trace";
+        if (trace_thread != 0) {
+            line << ':' << trace_thread;
+        }
+        line << "] " << begin_ << ' ' << now_ns() << ' ' << name_;
+        print_line(line.str());
+    }
+
+    static long long now_ns() {
+        return std::chrono::duration_cast<std::chrono::nanoseconds>(
+            std::chrono::steady_clock::now().time_since_epoch()).count();
+    }
+
+private:
+    std::string name_;
+    long long begin_;
+    bool active_;
+};
 
 #endif // __UTILS_H__
\ No newline at end of file
@@ -9,13 +9,24 @@ using namespace lbcrypto;
 
 int main(int argc, char* argv[]) {
     if (argc < 2 || !std::isdigit(argv[1][0])) {
-        std::cout << "Usage: " << argv[0] << " instance-size [--count_only]\n";
+        std::cout << "Usage: " << argv[0] << " instance-size [--count_only] [--run TAG] [--begin B --end E]\n";
+        std::cout << "                         [--batch_size N] [--stream]\n";
         std::cout << "  Instance-size: 0-SINGLE, 1-SMALL, 2-MEDIUM, 3-LARGE\n";
+        std::cout << "  --run TAG: read and write the inputs and outputs of run TAG\n";
+        std::cout << "  --batch_size N: custom number of samples in the batch\n";
+        std::cout << "  --begin B --end E: only decrypt the results B to E-1 of the batch,\n";
+        std::cout << "      into their own predictions file\n";
+        std::cout << "  --stream: wait for each result ciphertext, as the server computes on the\n";
+        std::cout << "      batch concurrently, and write each prediction as soon as it is decrypted\n";
         return 0;
     }
     auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
-    InstanceParams prms(size);
+    size_t batch_size = std::stoul(get_option(argc, argv, "--batch_size", "0"));
+    InstanceParams prms(size, fs::current_path(), get_option(argc, argv, "--run"), batch_size);
+    auto [begin, end] = get_shard(argc, argv, prms.getBatchSize());
+    bool stream = has_flag(argc, argv, "--stream");
 
+    TracePhase phase("Load keys");
     CryptoContext<DCRTPoly> cc;
     if (!Serial::DeserializeFromFile(prms.pubkeydir()/"cc.bin", cc,
                                     SerType::BINARY)) {
@@ -26,18 +37,30 @@ int main(int argc, char* argv[]) {
                                     SerType::BINARY)) {
         throw std::runtime_error("Failed to get secret key from  " + prms.seckeydir().string());
     }
+    phase.next("Decrypt results");
     Ciphertext<DCRTPoly> ctxt;     
     std::vector<float> output;
-    auto result_path = prms.encrypted_model_predictions_file();
+    auto result_path = (begin == 0 && end == prms.getBatchSize())
+        ? prms.encrypted_model_predictions_file()
+        : prms.encrypted_model_predictions_file(begin, end);
     std::ofstream out(result_path);
-    for (size_t i = 0; i < prms.getBatchSize(); ++i) {
+    for (size_t i = begin; i < end; ++i) {
         auto ctxt_path = prms.ctxtdowndir()/("cipher_result_" + std::to_string(i) + ".bin");
+        if (stream) {
+            wait_for_file(ctxt_path);
+        }
         if (!Serial::DeserializeFromFile(ctxt_path, ctxt, SerType::BINARY)) {
             throw std::runtime_error("Failed to get ciphertext from " + ctxt_path.string());
         }
         output = mlp_decrypt(cc, ctxt, sk);
-        auto max_id = argmax(output.data(), 1024);
+        auto max_id = argmax(output.data(), NORMALIZED_DIM);
         out << max_id << '\n';
+        if (stream) {
+            out.flush();
+            if (i == begin) {
+                print_line(FIRST_PREDICTION_LINE);
+            }
+        }
     }
 
     return 0;
@@ -8,36 +8,54 @@ using namespace lbcrypto;
 int main(int argc, char* argv[]){
 
     if (argc < 2 || !std::isdigit(argv[1][0])) {
-        std::cout << "Usage: " << argv[0] << " instance-size [--count_only]\n";
+        std::cout << "Usage: " << argv[0] << " instance-size [--count_only] [--run TAG] [--begin B --end E]\n";
+        std::cout << "                         [--batch_size N] [--stream DEPTH]\n";
         std::cout << "  Instance-size: 0-SINGLE, 1-SMALL, 2-MEDIUM, 3-LARGE\n";
+        std::cout << "  --run TAG: read and write the inputs and outputs of run TAG\n";
+        std::cout << "  --batch_size N: custom number of samples in the batch\n";
+        std::cout << "  --begin B --end E: only encrypt the samples B to E-1 of the batch\n";
+        std::cout << "  --stream DEPTH: stay at most DEPTH samples ahead of the server,\n";
+        std::cout << "      which computes on the batch concurrently\n";
         return 0;
     }
     auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
-    InstanceParams prms(size);
+    size_t batch_size = std::stoul(get_option(argc, argv, "--batch_size", "0"));
+    InstanceParams prms(size, fs::current_path(), get_option(argc, argv, "--run"), batch_size);
+    auto [begin, end] = get_shard(argc, argv, prms.getBatchSize());
+    size_t stream_depth = std::stoul(get_option(argc, argv, "--stream", "0"));
 
+    TracePhase phase("Load keys");
     CryptoContext<DCRTPoly> cc = read_crypto_context(prms);
 
     // Step 2: Read public key
     PublicKey<DCRTPoly> pk = read_public_key(prms);
 
+    phase.next("Load dataset");
     std::vector<Sample> dataset;
-    load_dataset(dataset, prms.test_input_file().c_str());
+    auto input_file = dataset_file(prms);
+    load_dataset(dataset, input_file.c_str());
     if (dataset.empty()) {
-        throw std::runtime_error("No data found in " + prms.test_input_file().string());
+        throw std::runtime_error("No data found in " + input_file.string());
     }
     // Step 2: Encrypt inputs
     if (dataset.size() != prms.getBatchSize()) {
         throw std::runtime_error("Dataset size does not match instance size");
     }
 
+    phase.next("Encrypt and serialize inputs");
     std::shared_ptr<const CiphertextImpl<DCRTPoly>> ctxt;
     fs::create_directories(prms.ctxtupdir());
-    for (size_t i = 0; i < dataset.size(); ++i) {
+    for (size_t i = begin; i < end; ++i) {
+        if (stream_depth > 0 && i - begin >= stream_depth) {
+            // Bound the number of inputs queued for the server
+            auto queued = i - stream_depth;
+            wait_for_file(prms.ctxtdowndir()/("cipher_result_" + std::to_string(queued) + ".bin"));
+        }
         auto *input = dataset[i].image;
         std::vector<float> input_vector(input, input + NORMALIZED_DIM);
         ctxt = mlp_encrypt(cc, input_vector, pk);
         auto ctxt_path = prms.ctxtupdir()/("cipher_input_" + std::to_string(i) + ".bin");
-        Serial::SerializeToFile(ctxt_path, ctxt, SerType::BINARY);
+        serialize_to_file_atomically(ctxt_path, ctxt);
     }
 
     return 0;
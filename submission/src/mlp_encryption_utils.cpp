@@ -46,6 +46,11 @@ void read_eval_keys(const InstanceParams& prms, CryptoContextT cc) {
 }
 
 
+// The input is replicated over all the ring_dim/2 slots: the Halevi-Shoup
+// matrix products of the compiled mlp rotate it cyclically, which needs a
+// periodic layout. With the ring dimension 2^11 there are exactly
+// NORMALIZED_DIM slots, so each ciphertext holds a single image and there is
+// no spare slot capacity to pack other images into (see submission/README.md).
 ConstCiphertext<DCRTPoly> mlp_encrypt(CryptoContext<DCRTPoly> cc, std::vector<float> input, PublicKey<DCRTPoly> pk) {
   std::vector<double> v11340(std::begin(input), std::end(input));
   uint32_t v11340_filled_n = cc->GetCryptoParameters()->GetElementParams()->GetRingDimension() / 2;
@@ -63,7 +68,7 @@ ConstCiphertext<DCRTPoly> mlp_encrypt(CryptoContext<DCRTPoly> cc, std::vector<fl
 std::vector<float> mlp_decrypt(CryptoContextT v11343, CiphertextT v11344, PrivateKeyT v11345) {
   PlaintextT v11346;
   v11343->Decrypt(v11345, v11344, &v11346);
-  v11346->SetLength(1024);
+  v11346->SetLength(NORMALIZED_DIM);
   const auto& v11347_cast = v11346->GetCKKSPackedValue();
   std::vector<float> v11347(v11347_cast.size());
   std::transform(std::begin(v11347_cast), std::end(v11347_cast), std::begin(v11347), [](const std::complex<double>& c) { return c.real(); });
@@ -71,8 +76,44 @@ std::vector<float> mlp_decrypt(CryptoContextT v11343, CiphertextT v11344, Privat
 }
 
 
+// Binary format: a 16-byte header (magic, version, number of samples,
+// pixels per sample) followed by little-endian float32 pixels, read in bulk.
+static void load_dataset_bin(std::vector<Sample> &dataset, std::ifstream &file,
+                             const char *filename) {
+  uint32_t header[3];
+  file.read(reinterpret_cast<char *>(header), sizeof(header));
+  if (!file || header[0] != PIXELS_VERSION || header[2] != MNIST_DIM) {
+    throw std::runtime_error("Malformed pixels file " + std::string(filename));
+  }
+  size_t num_samples = header[1];
+  std::vector<float> pixels(num_samples * MNIST_DIM);
+  file.read(reinterpret_cast<char *>(pixels.data()), pixels.size() * sizeof(float));
+  if (!file) {
+    throw std::runtime_error("Truncated pixels file " + std::string(filename));
+  }
+
+  size_t offset = dataset.size();
+  dataset.resize(offset + num_samples);
+  for (size_t i = 0; i < num_samples; i++) {
+    float *image = dataset[offset + i].image;
+    std::copy_n(pixels.data() + i * MNIST_DIM, MNIST_DIM, image);
+    // Pad remaining values with 0.0 if NORMALIZED_DIM > MNIST_DIM
+    std::fill(image + MNIST_DIM, image + NORMALIZED_DIM, 0.0f);
+  }
+}
+
 void load_dataset(std::vector<Sample> &dataset, const char *filename) {
-  std::ifstream file(filename);
+  std::ifstream file(filename, std::ios::in | std::ios::binary);
+  char magic[sizeof(PIXELS_MAGIC) - 1] = {};
+  file.read(magic, sizeof(magic));
+  if (file && std::equal(magic, magic + sizeof(magic), PIXELS_MAGIC)) {
+    load_dataset_bin(dataset, file, filename);
+    return;
+  }
+  // Text format: one sample per line
+  file.clear();
+  file.seekg(0);
+
   Sample sample;
   std::string line;
   while (std::getline(file, line)) {
@@ -90,6 +131,14 @@ void load_dataset(std::vector<Sample> &dataset, const char *filename) {
   }
 }
 
+// The harness writes the binary pixels file unless asked for text
+fs::path dataset_file(const InstanceParams& prms) {
+  if (fs::exists(prms.test_input_bin_file())) {
+    return prms.test_input_bin_file();
+  }
+  return prms.test_input_file();
+}
+
 int argmax(float *A, int N) {
   int max_idx = 0;
   for (int i = 1; i < N; i++) {
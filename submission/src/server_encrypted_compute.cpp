@@ -1,46 +1,250 @@
-
 #include "utils.h"
 #include "params.h"
 #include "mlp_openfhe.h"
 #include "mlp_encryption_utils.h"
+#include <algorithm>
+#include <atomic>
 #include <chrono>
+#include <cstdlib>
+#include <exception>
+#include <iomanip>
+#include <thread>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 using namespace lbcrypto;
 
+// Environment variable giving the number of threads when --threads is not given
+#define SERVER_THREADS_ENV "SERVER_THREADS"
+
+
+// Run the mlp on the ciphertexts [begin, end) of the batch of prms.
+// The ciphertexts are independent: each thread takes the next one and
+// deserializes, computes and serializes it, so that the I/O of some
+// threads overlaps with the computation of the others. The crypto
+// context and evaluation keys are shared read-only. The OpenMP threads
+// with which OpenFHE parallelizes each operation are split between the
+// threads, so that they do not oversubscribe the cores.
+// When streaming, each input is waited for until the client has written it.
+void compute_batch(CryptoContextT cc, const InstanceParams& prms, size_t begin, size_t end,
+                   size_t num_threads, bool stream = false) {
+    fs::create_directories(prms.ctxtdowndir());
+    std::atomic<size_t> next(begin);
+    auto compute = [&](size_t i) {
+        Ciphertext<DCRTPoly> ctxt;
+        auto input_ctxt_path = prms.ctxtupdir()/("cipher_input_" + std::to_string(i) + ".bin");
+        if (stream) {
+            TracePhase wait_phase("Wait for ciphertext " + std::to_string(i));
+            wait_for_file(input_ctxt_path);
+        }
+        TracePhase ctxt_phase("Deserialize ciphertext " + std::to_string(i));
+        if (!Serial::DeserializeFromFile(input_ctxt_path, ctxt, SerType::BINARY)) {
+            throw std::runtime_error("Failed to get ciphertexts from " + input_ctxt_path.string());
+        }
+        ctxt_phase.next("Compute ciphertext " + std::to_string(i));
+        auto start = std::chrono::steady_clock::now();
+        auto ctxtResult = mlp(cc, ctxt);
+        auto stop = std::chrono::steady_clock::now();
+        ctxt_phase.end();
+        std::chrono::duration<double, std::milli> duration = stop - start;
+        std::ostringstream message;
+        message << "         [server] Execution time for ciphertext " << i << " : "
+                << std::fixed << std::setprecision(3) << duration.count() << " ms";
+        print_line(message.str());
+        auto result_ctxt_path = prms.ctxtdowndir()/("cipher_result_" + std::to_string(i) + ".bin");
+        ctxt_phase.next("Serialize result " + std::to_string(i));
+        serialize_to_file_atomically(result_ctxt_path, ctxtResult);
+    };
+
+    // OpenFHE builds some of its precomputed tables on first use, which is
+    // not safe from several threads at once: the first ciphertext computed
+    // by the process builds them alone, on this thread
+    static bool warmed_up = false;
+    if (num_threads > 1 && !warmed_up && begin < end) {
+        compute(next++);
+        warmed_up = true;
+    }
+    num_threads = std::max<size_t>(1, std::min(num_threads, end - next));
+
+#ifdef _OPENMP
+    int omp_threads = omp_get_max_threads();
+    int worker_omp_threads = std::max(1, omp_threads / static_cast<int>(num_threads));
+#endif
+    std::exception_ptr error;
+    std::mutex error_mutex;
+    auto worker = [&](int thread) {
+        trace_thread = thread;
+#ifdef _OPENMP
+        omp_set_num_threads(worker_omp_threads);
+#endif
+        try {
+            for (size_t i = next++; i < end; i = next++) {
+                compute(i);
+            }
+        } catch (...) {
+            std::lock_guard<std::mutex> lock(error_mutex);
+            if (!error) {
+                error = std::current_exception();
+            }
+            // Let the other threads stop after their current ciphertext
+            next = end;
+        }
+    };
+
+    std::vector<std::thread> threads;
+    for (size_t t = 1; t < num_threads; ++t) {
+        threads.emplace_back(worker, static_cast<int>(t));
+    }
+    worker(0);
+    for (auto& thread : threads) {
+        thread.join();
+    }
+#ifdef _OPENMP
+    // The resident server computes the next requests with all of them again
+    omp_set_num_threads(omp_threads);
+#endif
+    if (error) {
+        std::rethrow_exception(error);
+    }
+}
+
+// Read a line from a socket, without its newline. Returns false at the end of the stream.
+static bool read_line(int fd, std::string& line) {
+    line.clear();
+    char c;
+    while (true) {
+        ssize_t n = read(fd, &c, 1);
+        if (n <= 0) {
+            return !line.empty();
+        }
+        if (c == '\n') {
+            return true;
+        }
+        line += c;
+    }
+}
+
+static void write_line(int fd, const std::string& line) {
+    std::string data = line + '\n';
+    size_t written = 0;
+    while (written < data.size()) {
+        ssize_t n = write(fd, data.data() + written, data.size() - written);
+        if (n <= 0) {
+            return;
+        }
+        written += n;
+    }
+}
+
+// Keep the crypto context and keys loaded and serve requests on a Unix socket,
+// one connection at a time, one request per line:
+//     compute <run> <begin> <end> [stream]
+//                                   run the mlp on the ciphertexts [begin, end) of the
+//                                   run ("-" for none), waiting for each of them with
+//                                   stream; answers "ok" or "error <message>"
+//     shutdown                      stop the server; answers "ok"
+void serve(CryptoContextT cc, InstanceSize size, size_t batch_size, const std::string& socket_path,
+           size_t num_threads) {
+    int server_fd = socket(AF_UNIX, SOCK_STREAM, 0);
+    sockaddr_un addr = {};
+    addr.sun_family = AF_UNIX;
+    if (server_fd < 0 || socket_path.size() >= sizeof(addr.sun_path)) {
+        throw std::runtime_error("Cannot create the socket " + socket_path);
+    }
+    std::copy(socket_path.begin(), socket_path.end(), addr.sun_path);
+    unlink(socket_path.c_str());
+    if (bind(server_fd, reinterpret_cast<sockaddr*>(&addr), sizeof(addr)) < 0 ||
+        listen(server_fd, 1) < 0) {
+        throw std::runtime_error("Cannot listen on the socket " + socket_path);
+    }
+    print_line("         [server] Ready on " + socket_path);
+
+    bool running = true;
+    while (running) {
+        int fd = accept(server_fd, nullptr, nullptr);
+        if (fd < 0) {
+            continue;
+        }
+        std::string line;
+        while (running && read_line(fd, line)) {
+            std::istringstream request(line);
+            std::string command;
+            request >> command;
+            if (command == "shutdown") {
+                running = false;
+                write_line(fd, "ok");
+            } else if (command == "compute") {
+                std::string run, mode;
+                size_t begin, end;
+                bool valid = static_cast<bool>(request >> run >> begin >> end);
+                request >> mode;
+                try {
+                    InstanceParams prms(size, fs::current_path(), run == "-" ? "" : run, batch_size);
+                    if (!valid || begin > end || end > prms.getBatchSize() ||
+                        !(mode.empty() || mode == "stream")) {
+                        throw std::invalid_argument("Invalid request: " + line);
+                    }
+                    compute_batch(cc, prms, begin, end, num_threads, mode == "stream");
+                    write_line(fd, "ok");
+                } catch (const std::exception& e) {
+                    write_line(fd, std::string("error ") + e.what());
+                }
+            } else {
+                write_line(fd, "error Unknown request: " + line);
+            }
+        }
+        close(fd);
+    }
+    close(server_fd);
+    unlink(socket_path.c_str());
+}
+
 
 int main(int argc, char* argv[]){
 
     if (argc < 2 || !std::isdigit(argv[1][0])) {
-        std::cout << "Usage: " << argv[0] << " instance-size \n";
+        std::cout << "Usage: " << argv[0] << " instance-size [--run TAG] [--begin B --end E] [--threads N]\n";
+        std::cout << "                         [--batch_size N] [--daemon SOCKET] [--stream]\n";
         std::cout << "  Instance-size: 0-SINGLE, 1-SMALL, 2-MEDIUM, 3-LARGE\n";
+        std::cout << "  --run TAG: read and write the inputs and outputs of run TAG\n";
+        std::cout << "  --batch_size N: custom number of samples in the batch\n";
+        std::cout << "  --begin B --end E: only compute on the ciphertexts B to E-1 of the batch\n";
+        std::cout << "  --threads N: number of ciphertexts processed concurrently, which share\n";
+        std::cout << "      the OpenMP threads\n";
+        std::cout << "      (default: $" SERVER_THREADS_ENV " or 1)\n";
+        std::cout << "  --daemon SOCKET: load the keys once and serve requests on the Unix socket\n";
+        std::cout << "  --stream: wait for each input ciphertext, as the client encrypts the batch\n";
+        std::cout << "      concurrently\n";
         return 0;
     }
     auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
-    InstanceParams prms(size);
+    size_t batch_size = std::stoul(get_option(argc, argv, "--batch_size", "0"));
+    InstanceParams prms(size, fs::current_path(), get_option(argc, argv, "--run"), batch_size);
+    auto [begin, end] = get_shard(argc, argv, prms.getBatchSize());
+    const char* threads_env = std::getenv(SERVER_THREADS_ENV);
+    size_t num_threads = std::stoul(get_option(argc, argv, "--threads",
+                                               threads_env ? threads_env : "1"));
+    std::string socket_path = get_option(argc, argv, "--daemon");
+    bool stream = has_flag(argc, argv, "--stream");
 
+    std::cout << "         [server] Loading keys" << std::endl;
+    TracePhase phase("Load keys");
     CryptoContext<DCRTPoly> cc = read_crypto_context(prms);
     read_eval_keys(prms, cc);
     PublicKey<DCRTPoly> pk = read_public_key(prms);
-    
-    std::cout << "         [server] Loading keys" << std::endl;
+    phase.end();
 
-    Ciphertext<DCRTPoly> ctxt;
-    fs::create_directories(prms.ctxtdowndir());
-    std::cout << "         [server] Run encrypted MNIST inference" << std::endl;
-    for (size_t i = 0; i < prms.getBatchSize(); ++i) {
-        auto input_ctxt_path = prms.ctxtupdir()/("cipher_input_" + std::to_string(i) + ".bin");
-        if (!Serial::DeserializeFromFile(input_ctxt_path, ctxt, SerType::BINARY)) {
-            throw std::runtime_error("Failed to get ciphertexts from " + input_ctxt_path.string());
-        }
-        auto start = std::chrono::high_resolution_clock::now();
-        auto ctxtResult = mlp(cc, ctxt);
-        auto end = std::chrono::high_resolution_clock::now();
-        auto duration = std::chrono::duration_cast<std::chrono::seconds>(end - start);
-        std::cout << "         [server] Execution time for ciphertext " << i << " : " 
-                << duration.count() << " seconds" << std::endl;
-        auto result_ctxt_path = prms.ctxtdowndir()/("cipher_result_" + std::to_string(i) + ".bin");
-        Serial::SerializeToFile(result_ctxt_path, ctxtResult, SerType::BINARY);
+    if (!socket_path.empty()) {
+        serve(cc, size, batch_size, socket_path, num_threads);
+        return 0;
     }
 
+    std::cout << "         [server] Run encrypted MNIST inference" << std::endl;
+    compute_batch(cc, prms, begin, end, num_threads, stream);
+
     return 0;
 }